@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+
+from r8music.actions.models import ActiveActions
+
+class Command(BaseCommand):
+    help = "Copies the rating of every active rate action onto its active actions (these are kept up to date by set_active_actions)"
+    
+    def handle(self, **options):
+        ActiveActions.objects.update_ratings()
@@ -1,6 +1,7 @@
 from itertools import groupby
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, OuterRef, Subquery
 from django.utils import timezone
 from django.core.paginator import Paginator
 
@@ -8,13 +9,19 @@ from django.contrib.auth.models import User
 
 from r8music.utils import fuzzy_groupby
 from r8music.music.models import Release, Track
+from r8music.profiles.models import UserStats
 
 class Action(models.Model):
-    user = models.ForeignKey(User, on_delete=models.PROTECT)
+    #(Indexed along with the creation, below)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, db_index=False)
     creation = models.DateTimeField(default=timezone.now)
     
+    class Meta:
+        #For activity feeds, of a user or of those they follow
+        indexes = [models.Index(fields=["user", "-creation"], name="action_user_creation_idx")]
+        
     def release_actions(self, release, **changes):
-        return release.active_actions.update_or_create(user=self.user, defaults=changes)[0]
+        return set_active_actions(self.user, release, **changes)
         
 class SaveAction(Action):
     release = models.ForeignKey(Release, on_delete=models.PROTECT)
@@ -56,10 +63,15 @@ class PickAction(Action):
 
 def enact(action):
     """Enact the complete semantics of an action."""
+    #(Imported here as the recommendations depend on these models)
+    from r8music.recommendations.neighbours import schedule_update_neighbours
 
     if isinstance(action, RateAction):
         listen, _ = ListenAction.objects.get_or_create(release=action.release, user=action.user)
         enact(listen)
+        
+        #The votes on the neighbours of the release have changed
+        schedule_update_neighbours(action.release.id)
     
     elif isinstance(action, ListenAction):
         if action.user.settings.listen_implies_unsave:
@@ -69,9 +81,16 @@ def enact(action):
     
 #
 
+class ActiveActionsQuerySet(models.QuerySet):
+    def update_ratings(self):
+        """Copy the ratings of the active rate actions (these are kept up to date
+           by set_active_actions)"""
+        self.update(rating=Subquery(RateAction.objects.filter(id=OuterRef("rate_id")).values("rating")))
+        
 class ActiveActions(models.Model):
-    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="active_actions")
-    release = models.ForeignKey(Release, on_delete=models.PROTECT, related_name="active_actions")
+    #(Both indexed together, below)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="active_actions", db_index=False)
+    release = models.ForeignKey(Release, on_delete=models.PROTECT, related_name="active_actions", db_index=False)
     
     #The existence of an action only means that action was taken at some point.
     #If the user undoes that action, it is removed from these fields.
@@ -80,19 +99,104 @@ class ActiveActions(models.Model):
     rate = models.ForeignKey(RateAction, on_delete=models.PROTECT, null=True, related_name="active_actions")
     picks = models.ManyToManyField(PickAction, related_name="active_actions")
     
+    #The rating of the active rate action (null if none), copied so that ratings
+    #are read without a join. Kept in step with rate by set_active_actions.
+    rating = models.IntegerField(null=True)
+    
+    objects = ActiveActionsQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            #So that concurrent requests can't create duplicates (see set_active_actions)
+            models.UniqueConstraint(fields=["user", "release"], name="activeactions_user_release_uniq")
+        ]
+        indexes = [
+            #The releases rated by a user, for profiles and stats
+            models.Index(
+                fields=["user", "release"], include=["rating"], name="activeactions_rated_idx",
+                condition=Q(rating__isnull=False)
+            ),
+            #The ratings of a release, for averages (and any lookup by release)
+            models.Index(fields=["release", "rating"], name="activeactions_release_rating")
+        ]
+        
     def picked_tracks(self):
         return self.picks.all().values_list("track_id", flat=True)
         
-    def rating(self):
-        return self.rate.rating if self.rate else None
-
     def action_names(self):
         return list(filter(lambda x: x, (
-            self.save_action and "save",
-            self.listen and "listen",
-            self.rate and "rate"
+            self.save_action_id and "save",
+            self.listen_id and "listen",
+            self.rate_id and "rate"
         )))
 
+def set_active_actions(user, release, **changes):
+    """Update (or create) the active actions of a user on a release, and their
+       stats to match."""
+    if not changes:
+        return release.active_actions.get_or_create(user=user)[0]
+        
+    if "rate" in changes:
+        changes["rating"] = changes["rate"].rating if changes["rate"] else None
+        
+    with transaction.atomic():
+        #The user is locked, so that concurrent changes are applied one after the
+        #other, and not while their stats are computed (see UserStats.of)
+        locked_user = User.objects.select_for_update(of=("self",), no_key=True) \
+            .select_related("stats", "settings").get(id=user.id)
+        
+        try:
+            stats = locked_user.stats
+            
+        except UserStats.DoesNotExist:
+            stats = None
+        
+        active_actions = ActiveActions.objects \
+            .select_related("release", "listen") \
+            .filter(user=user, release=release).first()
+        
+        user_timezone = locked_user.settings.timezone if stats else None
+        before = UserStats.contribution(active_actions, user_timezone)
+        
+        created = False
+        
+        if not active_actions:
+            try:
+                with transaction.atomic():
+                    active_actions = ActiveActions.objects.create(user=user, release=release, **changes)
+                    created = True
+                    
+            except IntegrityError:
+                #Created by a concurrent request since being looked up
+                active_actions = ActiveActions.objects.select_for_update(of=("self",)) \
+                    .select_related("release", "listen").get(user=user, release=release)
+                before = UserStats.contribution(active_actions, user_timezone)
+                
+        if not created:
+            for field, value in changes.items():
+                setattr(active_actions, field, value)
+                
+            active_actions.save(update_fields=changes.keys())
+            
+        #(Otherwise they'll be computed when next needed)
+        if stats:
+            counts = UserStats.contribution(active_actions, user_timezone)
+            counts.subtract(before)
+            stats.add(counts)
+            
+            #Updated rather than saved, as the stats may have been deleted since
+            #(e.g. on changing timezone), to be computed again when needed
+            UserStats.objects.filter(id=stats.id).update(
+                **{field: getattr(stats, field) for field in UserStats.count_fields}
+            )
+            
+    if "rate" in changes:
+        #(Imported here as the recommendations depend on these models)
+        from r8music.recommendations.compatibility import ratings_changed
+        ratings_changed(user.id)
+        
+    return active_actions
+
 #
 
 #The maximum period of time between two actions which can be grouped in an activity feed
@@ -142,12 +246,9 @@ def group_actions(actions):
         )
     ]
 
-def get_paginated_activity_feed(
-    filter_release_actions, filter_track_actions,
-    paginate_by, page_no=0
-):
-    """Get the actions which are active and match a filter, in reverse
-       chronological order, grouped by user, creation and release."""
+def get_activity(filter_release_actions, filter_track_actions):
+    """The ids and creation times of the actions which are active and match a
+       filter, in reverse chronological order"""
     
     #Separate querysets are needed because the active_actions field involves
     #a different join for each model
@@ -163,7 +264,16 @@ def get_paginated_activity_feed(
     #A queryset of actions of any kind which match the query
     combined_queryset = querysets[0].union(*querysets[1:])
     
-    chronological_actions = combined_queryset.order_by("-creation")
+    return combined_queryset.order_by("-creation")
+    
+def get_paginated_activity_feed(
+    filter_release_actions, filter_track_actions,
+    paginate_by, page_no=0
+):
+    """Get the actions which are active and match a filter, in reverse
+       chronological order, grouped by user, creation and release."""
+    
+    chronological_actions = get_activity(filter_release_actions, filter_track_actions)
     page_of_actions = Paginator(chronological_actions, paginate_by).get_page(page_no)
     
     action_ids = [id for id, creation in page_of_actions]
@@ -0,0 +1,62 @@
+"""The actions of the viewing user on the releases shown on a page (their
+   ratings, saves, listens and picks), to be overlaid on release grids and the
+   like. Fetched for any number of releases in one query, with the picks of
+   each aggregated into an array, and remembered for the rest of the request,
+   so that parts of a page showing the same releases don't each look them up."""
+
+from collections import namedtuple
+
+from django.db.models import Q
+from django.contrib.postgres.aggregates import ArrayAgg
+
+from .models import ActiveActions
+
+class ViewerActions(namedtuple("ViewerActions", ["rating", "saved", "listened", "picks"])):
+    """The rating of the viewer (or None), whether they saved or listened to
+       the release, and the ids of the tracks they picked"""
+
+no_actions = ViewerActions(None, False, False, [])
+
+class ViewerOverlay:
+    def __init__(self, user):
+        self.user = user
+        #By release id, including those without any actions
+        self.actions = {}
+    
+    def get(self, release_ids):
+        """The actions on each release, as {release id: ViewerActions}"""
+        missing = {id for id in release_ids if id not in self.actions}
+        
+        if missing and not self.user.is_anonymous:
+            rows = ActiveActions.objects.filter(user=self.user, release_id__in=missing) \
+                .values_list("release_id", "rating", "save_action_id", "listen_id") \
+                .annotate(picks=ArrayAgg("picks__track_id", filter=Q(picks__isnull=False)))
+            
+            for release_id, rating, save_id, listen_id, picks in rows:
+                self.actions[release_id] = ViewerActions(rating, save_id is not None, listen_id is not None, picks)
+        
+        for id in missing:
+            self.actions.setdefault(id, no_actions)
+        
+        return {id: self.actions[id] for id in release_ids}
+
+def overlay_activity(activity_groups, overlay):
+    """Set the viewer's actions on the releases of an activity feed, as
+       release.viewer_actions"""
+    activity = [item for group in activity_groups for item in group.activity]
+    actions = overlay.get([item.release.id for item in activity])
+    
+    for item in activity:
+        item.release.viewer_actions = actions[item.release.id]
+        
+    return activity_groups
+
+def viewer_overlay(request):
+    """The overlay of the user making the request, shared by everything
+       rendering that request"""
+    try:
+        return request.viewer_overlay
+    
+    except AttributeError:
+        request.viewer_overlay = ViewerOverlay(request.user)
+        return request.viewer_overlay
@@ -0,0 +1,122 @@
+from django.test import TestCase
+from django.db import IntegrityError
+from django.urls import reverse
+from django.db.models import Count
+
+from django.contrib.auth.models import User
+from r8music.testing import QueryBudgetTestCase
+from r8music.music.models import Release, Track
+from .models import SaveAction, RateAction, PickAction, ActiveActions, enact, set_active_actions, get_activity
+from .overlay import ViewerOverlay, ViewerActions, no_actions
+from r8music.recommendations.neighbours import update_all_neighbours
+from r8music.recommendations.personal import update_all_recommendations
+
+class ViewerOverlayTest(TestCase):
+    def test(self):
+        user = User.objects.create_user("user")
+        saved, rated, other = [
+            Release.objects.create(title=title, slug=title) for title in ["saved", "rated", "other"]
+        ]
+        track = Track.objects.create(release=rated, title="track", side=1, position=1)
+        
+        enact(SaveAction.objects.create(user=user, release=saved))
+        enact(RateAction.objects.create(user=user, release=rated, rating=6))
+        enact(PickAction.objects.create(user=user, track=track))
+        
+        overlay = ViewerOverlay(user)
+        
+        with self.assertNumQueries(1):
+            actions = overlay.get([saved.id, rated.id, other.id])
+            
+        self.assertEqual(actions, {
+            saved.id: ViewerActions(None, True, False, []),
+            rated.id: ViewerActions(6, False, True, [track.id]),
+            other.id: no_actions
+        })
+        
+        #Remembered, including those without actions
+        with self.assertNumQueries(0):
+            self.assertEqual(overlay.get([other.id, rated.id]), {other.id: no_actions, rated.id: actions[rated.id]})
+            
+    def test_activity(self):
+        user, viewer = User.objects.create_user("user"), User.objects.create_user("viewer")
+        release = Release.objects.create(title="release", slug="release")
+        
+        enact(RateAction.objects.create(user=user, release=release, rating=3))
+        enact(RateAction.objects.create(user=viewer, release=release, rating=6))
+        
+        self.client.force_login(viewer)
+        response = self.client.get(reverse("user_activity", args=[user.username]))
+        
+        activity = response.context_data["activity"][0].activity[0]
+        self.assertEqual(activity.release.viewer_actions.rating, 6)
+        self.assertContains(response, "you rated 6")
+        
+class ActiveRatingTest(TestCase):
+    def test(self):
+        user = User.objects.create_user("user")
+        release = Release.objects.create(title="release", slug="release")
+        rating = lambda: ActiveActions.objects.get(user=user, release=release).rating
+        
+        enact(RateAction.objects.create(user=user, release=release, rating=3))
+        self.assertEqual(rating(), 3)
+        
+        enact(RateAction.objects.create(user=user, release=release, rating=7))
+        self.assertEqual(rating(), 7)
+        
+        #Copied from the rate actions again, as for existing active actions
+        ActiveActions.objects.update(rating=None)
+        ActiveActions.objects.update_ratings()
+        self.assertEqual(rating(), 7)
+        
+        set_active_actions(user, release, rate=None)
+        self.assertEqual(rating(), None)
+        
+class QueryBudgetTest(QueryBudgetTestCase):
+    def test_homepage(self):
+        update_all_neighbours()
+        update_all_recommendations()
+        
+        #The universal activity feed
+        self.assertWithinBudget(reverse("homepage"), 9)
+        self.assertWithinBudget(reverse("activity_feed") + "?page_no=5", 9)
+        
+        user = User.objects.annotate(n=Count("following")).order_by("-n", "id").first()
+        self.client.force_login(user)
+        
+        #The feed prefetches the artists of each kind of action on the page,
+        #so this is the most, when there are all four kinds
+        response = self.assertWithinBudget(reverse("homepage"), 16)
+        self.assertTrue(response.context_data["recommendations"])
+        self.assertWithinBudget(reverse("activity_feed") + "?page_no=5", 13)
+        
+class IndexTest(QueryBudgetTestCase):
+    """Checks that the hot queries on actions are planned with the indexes
+       made for them (against the synthetic dataset, once analyzed)"""
+    
+    def setUp(self):
+        self.user = User.objects.annotate(n=Count("active_actions")).order_by("-n", "id").first()
+        
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+        
+    def test_user_feed(self):
+        activity = get_activity(
+            lambda release_actions: release_actions.filter(user=self.user),
+            lambda track_actions: track_actions.filter(user=self.user)
+        )
+        self.assertUsesIndex(activity[:20], "action_user_creation_idx")
+        
+    def test_profile(self):
+        self.assertUsesIndex(Release.objects.rated_by_user(self.user), "activeactions_rated_idx")
+        
+    def test_release_ratings(self):
+        release = Release.objects.annotate(n=Count("active_actions")).order_by("-n", "id").first()
+        self.assertUsesIndex(release.active_actions.exclude(rating=None), "activeactions_release_rating")
+        
+    def test_unique(self):
+        release = self.user.active_actions.first().release
+        
+        with self.assertRaises(IntegrityError):
+            ActiveActions.objects.create(user=self.user, release=release)
@@ -3,8 +3,10 @@ from django.views.generic import TemplateView
 from rest_framework import views, renderers
 from rest_framework.response import Response
 
-from django.db.models import Q
-from r8music.actions.models import get_paginated_activity_feed
+from django.db.models import Q, Exists, OuterRef
+from r8music.actions.models import ActiveActions, get_paginated_activity_feed
+from r8music.actions.overlay import viewer_overlay, overlay_activity
+from r8music.music.cards import load_release_cards
 
 def get_user_activity_feed(user, page_no=1, paginate_by=25):
     def filter_release_actions(release_actions):
@@ -25,11 +27,28 @@ def get_user_activity_feed(user, page_no=1, paginate_by=25):
 
 class Homepage(TemplateView):
     template_name = "homepage.html"
+    recommendation_no = 12
     
+    def get_recommendations(self, user):
+        """Precomputed, see recommendations.personal"""
+        if user.is_anonymous:
+            return []
+            
+        #Leaving out any listened to since they were computed
+        listened = ActiveActions.objects \
+            .filter(user=user, release=OuterRef("release")) \
+            .exclude(listen=None, rate=None)
+            
+        return load_release_cards([
+            recommendation.release for recommendation in user.recommendations
+                .filter(~Exists(listened)).select_related("release")[:self.recommendation_no]
+        ], viewer_overlay(self.request))
+        
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["activity"], context["page_obj"] = \
-            get_user_activity_feed(self.request.user)
+        activity, context["page_obj"] = get_user_activity_feed(self.request.user)
+        context["activity"] = overlay_activity(activity, viewer_overlay(self.request))
+        context["recommendations"] = self.get_recommendations(self.request.user)
         return context
 
 class ActivityFeed(views.APIView):
@@ -38,4 +57,5 @@ class ActivityFeed(views.APIView):
     def get(self, request):
         page_no = request.query_params.get("page_no")
         activity, _page_obj = get_user_activity_feed(self.request.user, page_no)
+        activity = overlay_activity(activity, viewer_overlay(request))
         return Response({"activity": activity}, template_name="activity_feed.html")
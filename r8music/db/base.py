@@ -0,0 +1,133 @@
+"""The PostgreSQL backend, with two ways of reusing connections:
+
+   - Persistent connections (CONN_MAX_AGE), as in the web server, with health
+     checks: if CONN_HEALTH_CHECKS is set, a connection kept from an earlier
+     request is checked before it is first used in a request, and replaced if
+     it was closed (e.g. the database restarted). As in Django 4.1.
+   - A pool, as in the workers, which open and close connections often, and
+     run tasks in several threads. Configured by a "pool" entry in OPTIONS,
+     as {"min_size": ..., "max_size": ...}. Closing a connection returns it to
+     the pool, which keeps up to min_size of them open between uses.
+
+   Use by setting the ENGINE of a database to "r8music.db"."""
+
+import os
+from threading import Lock
+
+import psycopg2.extras
+from psycopg2.pool import ThreadedConnectionPool
+
+from django.db.backends.postgresql import base
+
+#The pools of this process by database alias (a pool can't be shared with a
+#forked process, so they're also keyed by the process)
+pools = {}
+pools_lock = Lock()
+
+def get_pool(alias, conn_params, min_size=1, max_size=4):
+    key = (alias, os.getpid())
+
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ThreadedConnectionPool(min_size, max_size, **conn_params)
+
+        return pools[key]
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.closeall()
+
+        pools.clear()
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+        self.pool = None
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+
+    @property
+    def pool_options(self):
+        return self.settings_dict["OPTIONS"].get("pool")
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        #Not a parameter of psycopg2.connect
+        conn_params.pop("pool", None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_options:
+            return super().get_new_connection(conn_params)
+
+        self.pool = get_pool(self.alias, conn_params, **self.pool_options)
+        connection = self.pool.getconn()
+
+        #Connections left in the pool may have been closed since
+        while self.health_check_enabled and not self.is_pooled_connection_usable(connection):
+            self.pool.putconn(connection, close=True)
+            connection = self.pool.getconn()
+
+        #Set up as by the default backend, which does this when connecting
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get("isolation_level", connection.isolation_level)
+
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def is_pooled_connection_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        except psycopg2.Error:
+            return False
+
+        else:
+            #Not to leave a transaction open, if autocommit is off
+            connection.rollback()
+            return True
+
+    def connect(self):
+        super().connect()
+        #Just connected, so there's nothing to check until the next request
+        self.health_check_done = True
+
+    def _close(self):
+        if self.pool is None or self.connection is None:
+            return super()._close()
+
+        with self.wrap_database_errors:
+            #Rolls back any transaction left open, and closes the connection if broken
+            self.pool.putconn(self.connection)
+
+    def close_if_health_check_failed(self):
+        """Replace a connection kept from an earlier request if it has stopped
+           working. Only checked once per request, and not within a transaction,
+           where a broken connection should cause an error."""
+        if self.connection is None or not self.health_check_enabled \
+           or self.health_check_done or self.in_atomic_block:
+            return
+
+        if not self.is_usable():
+            self.close()
+
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def close_if_unusable_or_obsolete(self):
+        #Called at the start and end of each request
+        if self.connection is not None:
+            self.health_check_done = False
+
+        super().close_if_unusable_or_obsolete()
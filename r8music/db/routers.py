@@ -0,0 +1,92 @@
+"""Sends the queries of read-only requests to replicas of the database.
+
+   Requests with a safe method (GET, HEAD or OPTIONS) read from a replica,
+   listed in settings.DATABASE_REPLICAS, while all writes go to the primary.
+   A replica lags behind the primary, so a user who has just written (e.g.
+   posted an action) reads from the primary for `sticky_seconds` afterwards,
+   so that they see their own changes. This is remembered by a cookie rather
+   than in the session, as sessions are themselves read from the database.
+
+   Sessions are always read from the primary, as they're written on login.
+   Outside of requests (in commands and tasks), everything uses the primary."""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+#Longer than replicas are expected to lag behind
+sticky_seconds = 10
+sticky_cookie = "read_primary"
+
+#Always read from the primary
+primary_app_labels = {"sessions"}
+
+class RequestRouting:
+    def __init__(self, replica):
+        #The alias of the replica to read from, or None for the primary
+        self.replica = replica
+        self.wrote = False
+
+#The routing of the current request, if any
+current_routing = ContextVar("current_routing", default=None)
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_routing.get()
+
+        if routing is None:
+            return None
+
+        if routing.replica is None or routing.wrote or model._meta.app_label in primary_app_labels:
+            return "default"
+
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+
+        if routing is None:
+            return None
+
+        #Sessions being saved doesn't change what the user sees
+        if model._meta.app_label not in primary_app_labels:
+            routing.wrote = True
+
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        #The replicas have the same rows as the primary (otherwise, no opinion)
+        databases = {"default", *settings.DATABASE_REPLICAS}
+
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+
+        return None
+
+class ReplicaMiddleware:
+    """Chooses the database each request reads from. Should come before any
+       middleware which queries the database."""
+
+    safe_methods = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replicas = settings.DATABASE_REPLICAS
+        read_only = request.method in self.safe_methods and sticky_cookie not in request.COOKIES
+
+        routing = RequestRouting(random.choice(replicas) if replicas and read_only else None)
+        token = current_routing.set(routing)
+
+        try:
+            response = self.get_response(request)
+
+        finally:
+            current_routing.reset(token)
+
+        if routing.wrote and replicas:
+            response.set_cookie(sticky_cookie, "1", max_age=sticky_seconds, httponly=True, samesite="Lax")
+
+        return response
@@ -0,0 +1,114 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from django.contrib.auth.models import User
+from r8music.music.models import Artist, Release
+from .base import DatabaseWrapper, close_pools
+from .routers import sticky_cookie
+
+class ConnectionReuseTest(TestCase):
+    def setUp(self):
+        self.wrappers = []
+
+    def tearDown(self):
+        for wrapper in self.wrappers:
+            wrapper.close()
+
+        close_pools()
+
+    def make_wrapper(self, **settings):
+        #A connection separate from that of the test, to be closed under it
+        wrapper = DatabaseWrapper({**connection.settings_dict, **settings}, alias=connection.alias)
+        self.wrappers.append(wrapper)
+        return wrapper
+
+    def backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            return cursor.fetchone()[0]
+
+    def terminate(self, pid):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", [pid])
+
+    def new_request(self, wrapper):
+        #As done at the start and end of each request
+        wrapper.close_if_unusable_or_obsolete()
+
+    def test_persistent(self):
+        wrapper = self.make_wrapper(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+        pid = self.backend_pid(wrapper)
+
+        self.new_request(wrapper)
+        self.assertEqual(self.backend_pid(wrapper), pid)
+
+        #A connection closed between requests is replaced, rather than causing an error
+        self.terminate(pid)
+        self.new_request(wrapper)
+        self.assertNotEqual(self.backend_pid(wrapper), pid)
+
+    def test_pool(self):
+        wrapper = self.make_wrapper(
+            CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=True,
+            OPTIONS={"pool": {"min_size": 1, "max_size": 2}}
+        )
+        pid = self.backend_pid(wrapper)
+
+        #Closed at the end of the request, into the pool
+        self.new_request(wrapper)
+        self.assertIsNone(wrapper.connection)
+        self.assertEqual(self.backend_pid(wrapper), pid)
+
+        self.new_request(wrapper)
+        self.terminate(pid)
+        self.assertNotEqual(self.backend_pid(wrapper), pid)
+
+        #Other connections (in other threads) share the pool
+        other = self.make_wrapper(**wrapper.settings_dict)
+        self.assertNotEqual(self.backend_pid(other), self.backend_pid(wrapper))
+        self.assertIs(other.pool, wrapper.pool)
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTest(TestCase):
+    """Against two databases, where the replica isn't kept up to date, as if
+       it lagged behind indefinitely"""
+
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("user")
+        cls.release = Release.objects.create(title="Release", slug="release")
+
+        for instance in [cls.user, cls.release]:
+            instance.save(using="replica")
+
+    def get_rating(self):
+        response = self.client.get(reverse("release", args=[self.release.slug]))
+        self.assertEqual(response.status_code, 200)
+        user_actions = response.context_data["user_actions"]
+        return user_actions.rating if user_actions else None
+
+    def test_reads(self):
+        Artist.objects.using("replica").create(name="Replicated", slug="replicated")
+        Artist.objects.create(name="Not replicated", slug="not-replicated")
+
+        self.assertEqual(self.client.get(reverse("artist", args=["replicated"])).status_code, 200)
+        self.assertEqual(self.client.get(reverse("artist", args=["not-replicated"])).status_code, 404)
+
+    def test_read_your_writes(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_rating(), None)
+        self.assertNotIn(sticky_cookie, self.client.cookies)
+
+        response = self.client.post(reverse("release-rate", args=[self.release.id]), {"rating": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(sticky_cookie, response.cookies)
+
+        #Written to the primary, and read from it until the cookie expires
+        self.assertFalse(self.user.active_actions.using("replica").exists())
+        self.assertEqual(self.get_rating(), 5)
+
+        del self.client.cookies[sticky_cookie]
+        self.assertEqual(self.get_rating(), None)
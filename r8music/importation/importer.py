@@ -7,7 +7,7 @@ from django.db import transaction
 from background_task import background
 
 from r8music.music.models import (
-    Artist, Release, Track, generate_slug_tracked,
+    Artist, Release, Track, Tag, TagRanking, generate_slug_tracked, update_search_vectors,
     DiscogsTag, ArtistExternalLink, ReleaseExternalLink
 )
 from .models import (
@@ -15,6 +15,8 @@ from .models import (
     ArtistMBIDMap, ReleaseMBIDMap, DiscogsTagMap
 )
 from r8music.actions.models import SaveAction, ListenAction, RateAction, ActiveActions
+from r8music.profiles.models import UserStats
+from r8music.search.autocomplete import autocomplete_cache
 
 from r8music.utils import uniqify, mode_items
 from .utils import query_and_collect, musicbrainz_url, get_release_type_from_mb_str
@@ -453,6 +455,10 @@ class Importer:
             existing_track.pick_actions.update(track=matching_track)
         
     def replace_release(self, existing_release, release):
+        #The release date may have changed, so the stats of its listeners are
+        #deleted, to be recomputed when next needed
+        UserStats.objects.filter(user__active_actions__release=existing_release).delete()
+        
         #Move related objects to the new release object
         for related_model in [SaveAction, ListenAction, RateAction, ActiveActions]:
             related_model.objects.filter(release=existing_release).update(release=release)
@@ -460,10 +466,16 @@ class Importer:
         #The new release object was given a temporary slug
         release.slug = existing_release.slug
         
+        tag_ids = list(existing_release.tags.values_list("id", flat=True))
+        
         #Delete the release as well as related objects which weren't moved
         #(e.g. the MB link, tracks)
         existing_release.delete()
         
+        tags = Tag.objects.filter(id__in=tag_ids)
+        tags.update_release_counts()
+        TagRanking.objects.update_rankings(tags)
+        
         #Save the slug now that a clash is avoided
         release.save()
         
@@ -608,10 +620,22 @@ class Importer:
             for tag_name in response.discogs_tags
         ])
         
+        tags = Tag.objects.filter(id__in=[
+            tags_map.get(tag_name)
+            for response in release_responses
+            for tag_name in response.discogs_tags
+        ])
+        
+        tags.update_release_counts()
+        TagRanking.objects.update_rankings(tags)
+        
     def create_from_release_responses(self, release_responses, artist_map):
         artist_map = self.create_featured_artists(release_responses, artist_map)
         release_map = self.create_releases(release_responses, artist_map)
         self.create_tags_and_taggings(release_responses, release_map)
+        update_search_vectors()
+        #(Also noticed by the autocomplete index of each process, within seconds)
+        autocomplete_cache.invalidate()
         
     #
     
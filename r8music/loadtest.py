@@ -0,0 +1,248 @@
+"""An HTTP load tester which runs scripted scenarios against a server, as a
+   number of concurrent virtual users, and reports the latency and throughput
+   of each endpoint. Intended for use with a synthetic dataset (see
+   r8music.synthetic), whose users can all be logged into."""
+
+import json, requests
+from random import Random
+from time import perf_counter
+from threading import Thread, Lock
+from collections import defaultdict
+from urllib.parse import urljoin
+
+def percentile(sorted_values, p):
+    """The nearest-rank percentile of a sorted list"""
+    if not sorted_values:
+        return None
+
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class Results:
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, latency, ok):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def report(self, duration):
+        """Latencies in milliseconds and throughput in requests per second, by endpoint"""
+
+        def endpoint_report(endpoint, latencies):
+            latencies = sorted(latencies)
+
+            return {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "throughput": len(latencies) / duration,
+                "mean": sum(latencies) / len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1]
+            }
+
+        with self.lock:
+            return {
+                endpoint: endpoint_report(endpoint, latencies)
+                for endpoint, latencies in sorted(self.latencies.items())
+            }
+
+class VirtualUser:
+    """A browser session, which records the latency of each request"""
+
+    def __init__(self, base_url, results, random):
+        self.base_url = base_url
+        self.results = results
+        self.random = random
+        self.session = requests.Session()
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = perf_counter()
+
+        try:
+            response = self.session.request(method, urljoin(self.base_url, path), **kwargs)
+            ok = response.ok
+
+        except requests.exceptions.RequestException:
+            response, ok = None, False
+
+        self.results.add(endpoint, (perf_counter() - start) * 1000, ok)
+        return response
+
+    def get(self, endpoint, path, **kwargs):
+        return self.request(endpoint, "get", path, **kwargs)
+
+    def post(self, endpoint, path, **kwargs):
+        #The CSRF token is required by the API (session authentication)
+        headers = {"X-CSRFToken": self.session.cookies.get("csrftoken", "")}
+        return self.request(endpoint, "post", path, headers=headers, **kwargs)
+
+    def login(self, username, password):
+        self.get("login_form", "/login/")
+        self.post("login", "/login/", data={
+            "username": username, "password": password,
+            "csrfmiddlewaretoken": self.session.cookies.get("csrftoken", "")
+        }, allow_redirects=False)
+
+# Scenarios, each a function of a VirtualUser and the Sample of the dataset
+
+def browse_feed(user, sample):
+    """Open the homepage and scroll through the activity feed"""
+    user.get("homepage", "/")
+
+    for page_no in range(2, user.random.randint(2, 6)):
+        user.get("activity_feed", "/activity-feed?page_no=%d" % page_no)
+
+def browse_music(user, sample):
+    """Open an artist page, then some of their releases"""
+    artist_slug, release_slugs = user.random.choice(sample.artists)
+    user.get("artist", "/artist/" + artist_slug)
+
+    for release_slug in user.random.sample(release_slugs, min(len(release_slugs), 2)):
+        user.get("release", "/release/" + release_slug)
+        user.get("release_activity", "/release/%s/activity" % release_slug)
+
+def browse_users(user, sample):
+    username = user.random.choice(sample.usernames)
+
+    for path, endpoint in [("", "user_main"), ("/stats", "user_stats"), ("/friends", "user_friends")]:
+        user.get(endpoint, "/user/%s%s" % (username, path))
+
+def rate_and_pick(user, sample):
+    """Listen to, rate and pick tracks from a release, then undo some of it"""
+    release_id, track_ids = user.random.choice(sample.releases)
+
+    user.post("listen", "/releases/%d/listen/" % release_id)
+    user.post("rate", "/releases/%d/rate/" % release_id, data={"rating": user.random.randint(1, 8)})
+
+    for track_id in user.random.sample(track_ids, min(len(track_ids), 2)):
+        user.post("pick", "/tracks/%d/pick/" % track_id)
+
+    if user.random.random() < 0.2:
+        user.post("unrate", "/releases/%d/unrate/" % release_id)
+
+def autocomplete(user, sample):
+    """Type a name into the search box, one character at a time"""
+    name = user.random.choice(sample.names)
+
+    for length in range(2, min(len(name), 8) + 1):
+        user.get("search_api", "/api/search", params={"q": name[:length]})
+
+    user.get("search", "/search", params={"q": name})
+
+#The relative frequency of each scenario
+scenarios = {
+    "browse_feed": (browse_feed, 3),
+    "browse_music": (browse_music, 4),
+    "browse_users": (browse_users, 1),
+    "rate_and_pick": (rate_and_pick, 2),
+    "autocomplete": (autocomplete, 3)
+}
+
+class Sample:
+    """Objects from the dataset for the scenarios to use"""
+
+    def __init__(self, artists, releases, usernames, names):
+        #As [(slug, [release slugs])]
+        self.artists = artists
+        #As [(id, [track ids])]
+        self.releases = releases
+        self.usernames = usernames
+        #Artist names and release titles, for searching
+        self.names = names
+
+    @staticmethod
+    def from_database(n=200):
+        from django.contrib.auth.models import User
+        from r8music.music.models import Artist, Release
+
+        artists = Artist.objects.order_by("?").prefetch_related("releases")[:n]
+        releases = Release.objects.order_by("?").prefetch_related("tracks")[:n]
+
+        return Sample(
+            artists=[
+                (artist.slug, [release.slug for release in artist.releases.all()])
+                for artist in artists
+            ],
+            releases=[
+                (release.id, [track.id for track in release.tracks.all()])
+                for release in releases
+            ],
+            usernames=list(User.objects.order_by("?").values_list("username", flat=True)[:n]),
+            names=[artist.name for artist in artists] + [release.title for release in releases]
+        )
+
+class LoadTest:
+    def __init__(
+        self, base_url, sample, password, users=10, duration=60,
+        scenario_names=None, seed=0
+    ):
+        self.base_url = base_url
+        self.sample = sample
+        self.password = password
+        self.users = users
+        self.duration = duration
+        self.scenarios = [
+            scenarios[name] for name in (scenario_names or scenarios.keys())
+        ]
+        self.seed = seed
+        self.results = Results()
+
+    def run_user(self, n, deadline):
+        random = Random(self.seed + n)
+        user = VirtualUser(self.base_url, self.results, random)
+        user.login(random.choice(self.sample.usernames), self.password)
+
+        functions, weights = zip(*self.scenarios)
+
+        while perf_counter() < deadline:
+            scenario, = random.choices(functions, weights)
+            scenario(user, self.sample)
+
+    def run(self):
+        start = perf_counter()
+        deadline = start + self.duration
+
+        threads = [
+            Thread(target=self.run_user, args=(n, deadline), daemon=True)
+            for n in range(self.users)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return self.results.report(perf_counter() - start)
+
+def format_report(report):
+    columns = ["requests", "errors", "throughput", "mean", "p50", "p95", "p99", "max"]
+
+    lines = [
+        "%-18s" % "endpoint" + "".join("%11s" % column for column in columns),
+    ]
+
+    lines += [
+        "%-18s" % endpoint + "".join(
+            ("%11d" if isinstance(stats[column], int) else "%11.1f") % stats[column]
+            for column in columns
+        )
+        for endpoint, stats in report.items()
+    ]
+
+    total = sum(stats["throughput"] for stats in report.values())
+    lines.append("Total throughput: %.1f requests/s (latencies in ms)" % total)
+
+    return "\n".join(lines)
+
+def save_report(report, filename, **parameters):
+    with open(filename, "w") as f:
+        json.dump({"parameters": parameters, "endpoints": report}, f, indent=4)
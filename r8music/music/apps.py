@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
+def create_extensions(using, **kwargs):
+    """Create the Postgres extensions which the indexes of the models require"""
+    from django.db import connections
+    
+    with connections[using].cursor() as cursor:
+        #For the trigram indexes used in fuzzy search
+        cursor.execute("create extension if not exists pg_trgm")
+
 class MusicConfig(AppConfig):
     name = 'r8music.music'
+    
+    def ready(self):
+        pre_migrate.connect(create_extensions, sender=self)
@@ -0,0 +1,40 @@
+"""Release cards: what a release grid (release_grid, in release_list.html) shows
+   of each release. Loaded for a whole list of releases at once, in a fixed
+   number of queries however many releases there are: one for their artists,
+   one for the actions of the viewing user (see actions.overlay), and one for
+   their average ratings if they are shown (artists aren't needed where dates
+   are shown instead)."""
+
+from django.db.models import Avg, prefetch_related_objects
+
+from r8music.actions.models import ActiveActions
+from r8music.actions.overlay import no_actions
+
+def load_release_cards(releases, viewer=None, average_rating=False, artists=True):
+    """Takes a list or queryset of releases, and returns them as a list, each
+       with the actions of the viewer (a ViewerOverlay) as viewer_actions, and
+       optionally with average_rating"""
+    releases = list(releases)
+    release_ids = [release.id for release in releases]
+    
+    if artists:
+        #(Skipped if they were already prefetched)
+        prefetch_related_objects(releases, "artists")
+        
+    viewer_actions = viewer.get(release_ids) if viewer else {}
+    average_ratings = {}
+    
+    if releases and average_rating:
+        average_ratings = dict(
+            ActiveActions.objects.filter(release_id__in=release_ids)
+                .values("release_id").annotate(average=Avg("rating"))
+                .values_list("release_id", "average")
+        )
+        
+    for release in releases:
+        release.viewer_actions = viewer_actions.get(release.id, no_actions)
+        
+        if average_rating:
+            release.average_rating = average_ratings.get(release.id)
+            
+    return releases
@@ -0,0 +1,89 @@
+"""Charts of the best releases of all time, of each decade and of each year,
+   both of every type and of each type. As in v1, releases are ranked by the
+   lower bound of the confidence interval of their proportion of upvotes
+   (each rating an upvote through a sigmoid, as in recommendations.neighbours)
+   rather than by their average rating, so that a release with a couple of
+   perfect ratings doesn't outrank one rated highly by many.
+
+   Computed for every chart at once, from a single read of the ratings, as
+   aggregating the ratings of every release on each request would be far too
+   slow. Run periodically, by the update_charts command."""
+
+import heapq
+from collections import defaultdict
+
+import numpy as np
+
+from django.db import transaction
+
+from r8music.actions.models import ActiveActions
+from r8music.recommendations.neighbours import binomial_score, sigmoid
+from .models import Release, ChartEntry
+
+#The number of releases stored in each chart
+chart_length = 100
+
+all_time = "all-time"
+
+def periods(release_date):
+    """The periods of the charts a release can be in"""
+    year = (release_date or "")[:4]
+
+    if len(year) != 4 or not year.isdigit():
+        return [all_time]
+
+    return [all_time, year[:3] + "0s", year]
+
+def release_scores():
+    """The release ids which were rated, with their scores and average ratings"""
+    release_ids, ratings = np.array(
+        list(ActiveActions.objects.exclude(rating=None).values_list("release_id", "rating")),
+        dtype=int
+    ).reshape(-1, 2).T
+
+    release_ids, releases = np.unique(release_ids, return_inverse=True)
+
+    votes = np.bincount(releases, minlength=len(release_ids))
+    upvotes = np.bincount(releases, weights=sigmoid(ratings), minlength=len(release_ids))
+    averages = np.bincount(releases, weights=ratings, minlength=len(release_ids)) / np.maximum(votes, 1)
+
+    return release_ids, binomial_score(upvotes, votes), averages
+
+def charts():
+    """Yields ((period, type), [(release id, score, average rating)]) for
+       every chart, in order of score"""
+    release_ids, scores, averages = release_scores()
+    releases = dict(
+        (id, (type, release_date)) for id, type, release_date in
+        Release.objects.filter(id__in=release_ids.tolist()).values_list("id", "type", "release_date")
+    )
+
+    entries = defaultdict(list)
+
+    for release_id, score, average in zip(release_ids.tolist(), scores.tolist(), averages.tolist()):
+        type, release_date = releases[release_id]
+
+        for period in periods(release_date):
+            entries[period, None].append((score, release_id, average))
+
+            if type is not None:
+                entries[period, type].append((score, release_id, average))
+
+    for chart, chart_entries in entries.items():
+        yield chart, [
+            (release_id, score, average)
+            for score, release_id, average in heapq.nlargest(chart_length, chart_entries)
+        ]
+
+def update_all_charts():
+    with transaction.atomic():
+        ChartEntry.objects.all().delete()
+
+        ChartEntry.objects.bulk_create([
+            ChartEntry(
+                period=period, type=type, release_id=release_id,
+                rank=rank, score=score, average_rating=average
+            )
+            for (period, type), entries in charts()
+            for rank, (release_id, score, average) in enumerate(entries, 1)
+        ], batch_size=10000)
@@ -0,0 +1,42 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from r8music.synthetic import DatasetGenerator, password
+
+class Command(BaseCommand):
+    help = "Generates a synthetic dataset of artists, releases, users and actions, for load testing"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--artists", type=int, default=10000)
+        parser.add_argument("--releases-per-artist", type=int, default=4)
+        parser.add_argument("--tracks-per-release", type=int, default=10)
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument("--follows-per-user", type=int, default=20)
+        parser.add_argument("--ratings-per-user", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=10000,
+            help="The number of rows created at once")
+        
+    def handle(self, **options):
+        start = perf_counter()
+        log = lambda message: self.stdout.write("[%.1fs] %s" % (perf_counter() - start, message))
+        
+        generator = DatasetGenerator(
+            artists=options["artists"],
+            releases_per_artist=options["releases_per_artist"],
+            tracks_per_release=options["tracks_per_release"],
+            users=options["users"],
+            follows_per_user=options["follows_per_user"],
+            ratings_per_user=options["ratings_per_user"],
+            seed=options["seed"],
+            chunk_size=options["chunk_size"],
+            log=log
+        )
+        
+        #All or nothing
+        with transaction.atomic():
+            generator.generate()
+        
+        log("Done. Every user's password is '%s'" % password)
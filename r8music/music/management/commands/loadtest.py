@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from r8music.loadtest import LoadTest, Sample, scenarios, format_report, save_report
+from r8music.synthetic import password
+
+class Command(BaseCommand):
+    help = "Runs scripted scenarios against a running server and reports the latency of each endpoint"
+    
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://localhost:8000",
+            help="The server under test, which should use the same database")
+        parser.add_argument("--users", type=int, default=10,
+            help="The number of concurrent virtual users")
+        parser.add_argument("--duration", type=float, default=60,
+            help="In seconds")
+        parser.add_argument("--scenario", action="append", choices=scenarios.keys(),
+            help="Run only these scenarios (default: all)")
+        parser.add_argument("--password", default=password,
+            help="The password of the users, as created by generate_dataset")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output",
+            help="Save the report as JSON, for comparing runs")
+        
+    def handle(self, **options):
+        sample = Sample.from_database()
+        
+        load_test = LoadTest(
+            options["url"], sample, options["password"],
+            users=options["users"],
+            duration=options["duration"],
+            scenario_names=options["scenario"],
+            seed=options["seed"]
+        )
+        
+        self.stdout.write("Running %d users against %s for %gs" % (options["users"], options["url"], options["duration"]))
+        report = load_test.run()
+        self.stdout.write(format_report(report))
+        
+        if options["output"]:
+            save_report(
+                report, options["output"],
+                url=options["url"], users=options["users"], duration=options["duration"],
+                scenarios=options["scenario"] or list(scenarios.keys())
+            )
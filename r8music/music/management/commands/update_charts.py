@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.music.charts import update_all_charts
+
+class Command(BaseCommand):
+    help = "Recomputes the charts of every period and type (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_all_charts()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from r8music.music.models import Artist, Release
+
+class Command(BaseCommand):
+    help = "Stores the search vectors of every artist and release (new ones are indexed by the importer)"
+    
+    def handle(self, **options):
+        with transaction.atomic():
+            Artist.objects.update_search_vectors()
+            Release.objects.update_search_vectors()
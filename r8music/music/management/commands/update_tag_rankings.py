@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.music.models import Tag, TagRanking
+
+class Command(BaseCommand):
+    help = "Reranks the releases of every tag by average rating (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        TagRanking.objects.update_rankings(Tag.objects.all())
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+
+from r8music.music.models import Tag
+
+class Command(BaseCommand):
+    help = "Recounts the releases of every tag (these are kept up to date by the importer)"
+    
+    def handle(self, **options):
+        Tag.objects.update_release_counts()
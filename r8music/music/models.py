@@ -1,10 +1,15 @@
 from itertools import count
+from collections import defaultdict
 from unidecode import unidecode
 
-from django.db import models
-from django.db.models import Count, Avg, Q, F
+from django.db import models, connection, transaction
+from django.db.models import Count, Avg, Q, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django_enumfield import enum
 
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
+
 from django.template.defaultfilters import slugify
 
 from django.contrib.auth.models import User
@@ -26,6 +31,38 @@ def generate_slug_tracked(used_slugs, name):
 def make_runtime_str(milliseconds):
     return "%d:%02d" % (milliseconds//60000, (milliseconds/1000) % 60)
 
+# Full text search
+
+def search_document(*texts):
+    """The text to be indexed for searching, including ASCII transliterations
+       of the texts where they differ (so that "bjork" finds "Björk")."""
+    transliterations = [unidecode(text) for text in texts]
+    return " ".join(list(texts) + [
+        transliteration for text, transliteration in zip(texts, transliterations)
+        if transliteration != text
+    ])
+
+def store_search_vectors(model, documents, chunk_size=1000):
+    """Stores the search vectors of a model with a search_vector column, from
+       (id, primary document, secondary document) where the primary document
+       (e.g. the name) is ranked above the secondary (e.g. the artists)."""
+    
+    table = model._meta.db_table
+    
+    with connection.cursor() as cursor:
+        for start in range(0, len(documents), chunk_size):
+            chunk = documents[start:start+chunk_size]
+            
+            cursor.execute("""
+                update {table} set search_vector =
+                    setweight(to_tsvector(document.primary_text), 'A')
+                    || setweight(to_tsvector(document.secondary_text), 'B')
+                from (values {values}) as document (id, primary_text, secondary_text)
+                where {table}.id = document.id
+            """.format(table=table, values=", ".join(["(%s, %s, %s)"] * len(chunk))),
+                [value for document in chunk for value in document]
+            )
+
 #
 
 class TagQuerySet(models.QuerySet):
@@ -33,10 +70,15 @@ class TagQuerySet(models.QuerySet):
         return self.annotate(frequency=Count("releases")).order_by("-frequency")
 
     def frequencies(self):
-        return dict(
-            self.annotate(frequency=Count("releases"))
-                .values_list("id", "frequency")
-        )
+        return dict(self.values_list("id", "release_count"))
+        
+    def update_release_counts(self):
+        """Recount the releases of these tags (after tagging, or deleting tagged releases)"""
+        counts = self.model.releases.through.objects \
+            .filter(tag_id=OuterRef("id")).values("tag_id") \
+            .annotate(n=Count("id")).values("n")
+        
+        self.update(release_count=Coalesce(Subquery(counts), 0))
 
 class Tag(models.Model):
     name = models.TextField()
@@ -45,6 +87,9 @@ class Tag(models.Model):
     
     owner = models.ForeignKey(User, on_delete=models.PROTECT, null=True)
     
+    #The number of releases with this tag, maintained by update_release_counts
+    release_count = models.IntegerField(default=0)
+    
     objects = TagQuerySet.as_manager()
 
 class DiscogsTag(Tag):
@@ -52,6 +97,13 @@ class DiscogsTag(Tag):
 
 #
 
+class ArtistQuerySet(models.QuerySet):
+    def update_search_vectors(self):
+        store_search_vectors(Artist, [
+            (id, search_document(name), "")
+            for id, name in self.values_list("id", "name")
+        ])
+
 class Artist(models.Model):
     name = models.TextField()
     slug = models.TextField()
@@ -61,6 +113,18 @@ class Artist(models.Model):
     image_url = models.TextField(null=True)
     image_thumb_url = models.TextField(null=True)
     
+    #Maintained by update_search_vectors (null until then)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    
+    objects = ArtistQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            #For fuzzy search
+            GinIndex(fields=["name"], opclasses=["gin_trgm_ops"], name="music_artist_name_trgm")
+        ]
+    
     @property
     def all_tracks(self):
         return Track.objects.filter(release__artists=self)
@@ -99,21 +163,29 @@ class ReleaseType(enum.Enum):
     MIXTAPE_STREET = 14
     DEMO = 15
     OTHER = 16
+    
+    __labels__ = {
+        ALBUM: "Album", SINGLE: "Single", EP: "EP", BROADCAST: "Broadcast",
+        COMPILATION: "Compilation", SOUNDTRACK: "Soundtrack", SPOKENWORD: "Spoken word",
+        INTERVIEW: "Interview", AUDIOBOOK: "Audiobook", AUDIO_DRAMA: "Audio drama",
+        LIVE: "Live", REMIX: "Remix", DJ_MIX: "DJ mix", MIXTAPE_STREET: "Mixtape/street",
+        DEMO: "Demo", OTHER: "Other"
+    }
 
 class ReleaseQuerySet(models.QuerySet):
     def albums(self):
         return self.filter(type=ReleaseType.ALBUM)
         
     def with_average_rating(self):
-        return self.annotate(average_rating=Avg("active_actions__rate__rating"))
+        return self.annotate(average_rating=Avg("active_actions__rating"))
         
     def order_by_average_rating(self):
         return self.with_average_rating().order_by("-average_rating")
         
     def rated_by_user(self, user):
-        return self.filter(active_actions__user=user) \
-            .annotate(rating_by_user=F("active_actions__rate__rating")) \
-            .exclude(rating_by_user=None)
+        #(In one filter, so that both conditions apply to the same join)
+        return self.filter(active_actions__user=user, active_actions__rating__isnull=False) \
+            .annotate(rating_by_user=F("active_actions__rating"))
             
     def with_actions_by_user(self, user):
         return self.filter(active_actions__user=user) \
@@ -133,6 +205,22 @@ class ReleaseQuerySet(models.QuerySet):
             .exclude(save=None) \
             .annotate(save_timestamp=F("active_actions__save_action__creation"))
         
+    def update_search_vectors(self):
+        """Index the titles of the releases, and the names of their artists"""
+        titles = {}
+        artist_names = defaultdict(list)
+        
+        for id, title, artist_name in self.values_list("id", "title", "artists__name"):
+            titles[id] = title
+            
+            if artist_name:
+                artist_names[id].append(artist_name)
+        
+        store_search_vectors(Release, [
+            (id, search_document(title), search_document(*artist_names[id]))
+            for id, title in titles.items()
+        ])
+        
 class Release(models.Model):
     title = models.TextField()
     slug = models.TextField(unique=True)
@@ -156,10 +244,18 @@ class Release(models.Model):
     colour_2 = models.TextField(null=True)
     colour_3 = models.TextField(null=True)
     
+    #Maintained by update_search_vectors (null until then)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    
     objects = ReleaseQuerySet.as_manager()
     
     class Meta:
         ordering = ["release_date"]
+        indexes = [
+            GinIndex(fields=["search_vector"]),
+            #For fuzzy search
+            GinIndex(fields=["title"], opclasses=["gin_trgm_ops"], name="music_release_title_trgm")
+        ]
     
     @property
     def is_album(self):
@@ -178,7 +274,7 @@ class Release(models.Model):
         self.save()
     
     def average_rating(self):
-        return self.active_actions.aggregate(average=Avg("rate__rating"))["average"]
+        return self.active_actions.aggregate(average=Avg("rating"))["average"]
     
     def tracks_extra(self):
         tracks = self.tracks.all()
@@ -187,6 +283,80 @@ class Release(models.Model):
             "runtime": make_runtime_str(sum(track.runtime for track in tracks if track.runtime)),
         }
 
+def update_search_vectors():
+    """Index any new artists and releases, as well as the releases of new
+       artists (which may have replaced an artist of a different name)."""
+    new_artists = Artist.objects.filter(search_vector=None)
+    
+    #(A subquery, so that the artists aren't limited to those in the filter)
+    Release.objects.filter(id__in=Release.objects.filter(
+        Q(search_vector=None) | Q(artists__in=new_artists)
+    ).values("id")).update_search_vectors()
+    new_artists.update_search_vectors()
+
+class TagRankingQuerySet(models.QuerySet):
+    def update_rankings(self, tags):
+        """Rerank the releases of the given tags (a queryset) by average rating,
+           in one insert from a select"""
+        rankings = Release.tags.through.objects \
+            .filter(tag__in=tags) \
+            .values("tag_id", "release_id") \
+            .annotate(average_rating=Avg("release__active_actions__rating")) \
+            .annotate(rank=Window(
+                RowNumber(), partition_by=[F("tag_id")],
+                #Unrated releases last
+                order_by=[F("average_rating").desc(nulls_last=True), F("release_id")]
+            )) \
+            .values_list("tag_id", "release_id", "average_rating", "rank")
+        
+        #(Annotations are selected in the order they were added)
+        sql, params = rankings.query.sql_with_params()
+        
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.filter(tag__in=tags).delete()
+            cursor.execute(
+                "insert into {table} (tag_id, release_id, average_rating, rank) {select}"
+                    .format(table=self.model._meta.db_table, select=sql),
+                params
+            )
+
+class TagRanking(models.Model):
+    """The releases of a tag in order of average rating, precomputed so that
+       tag pages are read by a range of ranks. Refreshed periodically (see the
+       update_tag_rankings command), and by the importer for new releases."""
+    
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="rankings")
+    release = models.ForeignKey(Release, on_delete=models.CASCADE, related_name="+")
+    #From 1, without gaps until releases are deleted
+    rank = models.IntegerField()
+    average_rating = models.FloatField(null=True)
+    
+    objects = TagRankingQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ["rank"]
+        indexes = [models.Index(fields=["tag", "rank"])]
+
+class ChartEntry(models.Model):
+    """A release in a chart of the best releases of all time, of a decade or
+       of a year, by the lower bound of the confidence interval of their
+       ratings (see charts.py). Recomputed periodically, by update_charts."""
+    
+    #"all-time", a decade ("1990s") or a year ("1994")
+    period = models.TextField()
+    #Null in the charts of releases of any type
+    type = enum.EnumField(ReleaseType, null=True, default=None)
+    
+    release = models.ForeignKey(Release, on_delete=models.CASCADE, related_name="+")
+    #From 1, without gaps until releases are deleted
+    rank = models.IntegerField()
+    score = models.FloatField()
+    average_rating = models.FloatField()
+    
+    class Meta:
+        ordering = ["rank"]
+        indexes = [models.Index(fields=["period", "type", "rank"])]
+
 class TrackQuerySet(models.QuerySet):
     def order_by_popularity(self):
         is_picked = Q(release__active_actions__picks__track_id=F("id"))
@@ -1,7 +1,19 @@
 from django.test import TestCase
 from django.core.exceptions import ValidationError
+from django.db.models import Count, F
+from django.urls import reverse
 
-from .models import Artist, generate_slug
+from django.contrib.auth.models import User
+from r8music.testing import QueryBudgetTestCase
+from r8music.synthetic import DatasetGenerator
+from r8music.recommendations.neighbours import update_all_neighbours
+from r8music.recommendations.related_tags import update_related_tags
+from r8music.actions.models import RateAction, enact
+from .models import Artist, Release, ReleaseType, Track, Tag, ChartEntry, generate_slug
+from .charts import update_all_charts
+from .cards import load_release_cards
+from r8music.actions.overlay import ViewerOverlay
+from .urls import url_for_artist, url_for_release, url_for_tag
 
 class SlugTest(TestCase):
     #Fields which won't be assigned valid values
@@ -21,3 +33,139 @@ class SlugTest(TestCase):
             
         create_artist_and_clean("+-")
         create_artist_and_clean("シートベルツ")
+
+class DatasetGeneratorTest(TestCase):
+    def generate(self, **options):
+        DatasetGenerator(artists=5, users=5, **options).generate()
+        self.assertTrue(Release.objects.exists())
+        
+    def test_no_tracks(self):
+        self.generate(tracks_per_release=0)
+        self.assertFalse(Track.objects.exists())
+        
+    def test_no_follows(self):
+        self.generate(follows_per_user=0)
+        
+    def test_no_ratings(self):
+        self.generate(ratings_per_user=0)
+        
+class ChartsTest(TestCase):
+    def test(self):
+        users = [User.objects.create_user("user%d" % n) for n in range(10)]
+        
+        def create_release(title, release_date, type, ratings):
+            release = Release.objects.create(title=title, slug=title, release_date=release_date, type=type)
+            
+            for user, rating in zip(users, ratings):
+                enact(RateAction.objects.create(user=user, release=release, rating=rating))
+                
+            return release
+            
+        #Rated highly by many, rather than perfectly by a few
+        many = create_release("many", "1994-05-01", ReleaseType.ALBUM, [7]*10)
+        few = create_release("few", "1994", ReleaseType.EP, [8]*2)
+        other_decade = create_release("other", "2001", ReleaseType.ALBUM, [5]*3)
+        
+        update_all_charts()
+        chart = lambda period, type=None: [
+            entry.release for entry in ChartEntry.objects.filter(period=period, type=type)
+        ]
+        
+        self.assertEqual(chart("all-time"), [many, few, other_decade])
+        self.assertEqual(chart("1990s"), [many, few])
+        self.assertEqual(chart("1994", ReleaseType.EP), [few])
+        self.assertEqual(chart("2000s", ReleaseType.ALBUM), [other_decade])
+        
+        self.assertEqual(ChartEntry.objects.get(period="1994", type=None, rank=1).average_rating, 7)
+        
+class QueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        self.user = User.objects.annotate(n=Count("active_actions")).order_by("-n", "id").first()
+        self.client.force_login(self.user)
+        
+    def test_artist_page(self):
+        artist = Artist.objects.annotate(n=Count("releases")).order_by("-n", "id").first()
+        self.assertWithinBudget(url_for_artist(artist), 15)
+        
+    def test_release_page(self):
+        release = Release.objects.annotate(n=Count("active_actions")).order_by("-n", "id").first()
+        other_user = release.active_actions.exclude(user=self.user).first().user
+        #So that the recommendations are shown
+        update_all_neighbours()
+        
+        self.assertWithinBudget(url_for_release(release), 19)
+        self.assertWithinBudget(url_for_release(release) + "?compare=" + other_user.username, 21)
+        
+    def test_tag_page(self):
+        tag = Tag.objects.order_by_frequency().first()
+        first_page = self.assertWithinBudget(url_for_tag(tag), 7)
+        second_page = self.assertWithinBudget(url_for_tag(tag) + "?after=30", 7)
+        
+        self.assertEqual(second_page.context_data["previous_rank"], 31)
+        
+        #Back to the first page, by the first rank of the second
+        self.assertEqual(
+            self.assertWithinBudget(url_for_tag(tag) + "?before=31", 7).context_data["object_list"],
+            first_page.context_data["object_list"]
+        )
+        
+        #In order of average rating, as when computed on the fly
+        self.assertEqual(
+            first_page.context_data["object_list"],
+            list(tag.releases.with_average_rating().order_by(F("average_rating").desc(nulls_last=True), "id")[:30])
+        )
+        
+    def test_tag_index(self):
+        update_related_tags()
+        response = self.assertWithinBudget(reverse("tag_index"), 6)
+        
+        tag = response.context_data["object_list"][0]
+        self.assertEqual(tag, Tag.objects.order_by("-release_count", "id").first())
+        self.assertEqual(
+            [ranking.release for ranking in tag.top_rankings],
+            list(tag.releases.with_average_rating().order_by(F("average_rating").desc(nulls_last=True), "id")[:3])
+        )
+        
+    def test_chart_page(self):
+        update_all_charts()
+        
+        for url in [reverse("charts"), reverse("chart", args=["2000s"]) + "?type=1", reverse("chart", args=["2004"])]:
+            response = self.assertWithinBudget(url, 5)
+            self.assertTrue(response.context_data["object_list"])
+            
+    def test_release_cards(self):
+        for release_no in [10, 100]:
+            releases = Release.objects.order_by("id")[:release_no]
+            
+            #One query for the releases, and one each for their artists, the
+            #actions of the viewer and the average ratings
+            with self.assertNumQueries(4):
+                cards = load_release_cards(releases, ViewerOverlay(self.user), average_rating=True)
+                
+                for release in cards:
+                    list(release.artists.all())
+                    
+        rated = self.user.active_actions.exclude(rate=None).select_related("release", "rate").first()
+        release, = load_release_cards([rated.release], ViewerOverlay(self.user), average_rating=True)
+        
+        self.assertEqual(release.viewer_actions.rating, rated.rate.rating)
+        self.assertEqual(release.average_rating, Release.objects.get(id=release.id).average_rating())
+        
+    def test_release_actions(self):
+        release = Release.objects.exclude(active_actions__user=self.user).first()
+        post = lambda action, max_queries, data=None: self.assertWithinBudget(
+            reverse("release-" + action, args=[release.id]), max_queries, method="post", data=data
+        )
+        
+        post("save", 9)
+        post("listen", 14)
+        post("rate", 27, {"rating": 5})
+        post("unrate", 10)
+        post("unlisten", 7)
+        post("unsave", 7)
+        
+    def test_track_actions(self):
+        track = Track.objects.exclude(release__active_actions__user=self.user).first()
+        
+        for action, max_queries in [("pick", 9), ("unpick", 11)]:
+            self.assertWithinBudget(reverse("track-" + action, args=[track.id]), max_queries, method="post")
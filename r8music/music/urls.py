@@ -5,7 +5,7 @@ from r8music.utils import prefix_redirect_route
 from .views import (
     ArtistIndex, ArtistMainPage, ArtistActivityPage,
     ReleaseMainPage, ReleaseActivityPage, EditReleasePage,
-    TagPage, ReleaseViewSet, TrackViewSet
+    TagIndex, TagPage, ChartPage, ReleaseViewSet, TrackViewSet
 )
 
 urlpatterns = [
@@ -21,7 +21,11 @@ urlpatterns = [
     path("release/<slug>/activity", ReleaseActivityPage.as_view(), name="release_activity"),
     path("release/<slug>/edit", EditReleasePage.as_view(), name="edit_release"),
     
+    path("tags", TagIndex.as_view(), name="tag_index"),
     path("tag/<int:pk>", TagPage.as_view(), name="tag"),
+    
+    path("charts", ChartPage.as_view(), name="charts"),
+    path("charts/<period>", ChartPage.as_view(), name="chart"),
 ]
 
 router = routers.SimpleRouter()
@@ -1,8 +1,9 @@
-from collections import defaultdict
+import re
+from datetime import date
 
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
+from django.db.models import Prefetch
 from django.views.generic import DetailView, ListView
-from django.views.generic.list import MultipleObjectMixin
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404
 
@@ -11,11 +12,15 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from django.contrib.auth.models import User
-from r8music.music.models import Artist, Release, Track, Tag
+from r8music.music.models import Artist, Release, ReleaseType, Track, Tag, TagRanking, ChartEntry
 from r8music.actions.models import (
     SaveAction, ListenAction, RateAction, PickAction,
-    ActiveActions, enact, get_paginated_activity_feed
+    ActiveActions, enact, set_active_actions, get_paginated_activity_feed
 )
+from r8music.recommendations.models import RelatedTag
+from r8music.music.charts import all_time
+from r8music.music.cards import load_release_cards
+from r8music.actions.overlay import viewer_overlay, overlay_activity
 
 class ArtistIndex(ListView):
     model = Artist
@@ -35,24 +40,12 @@ class AbstractArtistPage(DetailView):
 class ArtistMainPage(AbstractArtistPage):
     template_name = "artist_main.html"
 
-    def add_user_ratings(self, context):
-        #A defaultdict allows the template to look up a release whether or not there is a rating
-        user_ratings = defaultdict(lambda: None)
-        
-        if not self.request.user.is_anonymous:
-            user_ratings.update({
-                id: user_rating for id, user_rating
-                in ActiveActions.objects
-                    .filter(release__artists=context["artist"], user=self.request.user)
-                    .exclude(rate=None)
-                    .values_list("release_id", "rate__rating")
-            })
-        
-        context["get_user_rating"] = lambda release: user_ratings[release.id]
-        
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        self.add_user_ratings(context)
+        context["releases"] = load_release_cards(
+            context["artist"].releases.order_by("release_date"),
+            viewer_overlay(self.request), average_rating=True, artists=False
+        )
         return context
 
 class ArtistActivityPage(AbstractArtistPage):
@@ -70,6 +63,7 @@ class ArtistActivityPage(AbstractArtistPage):
             lambda track_actions: track_actions.filter(pk=None),
             paginate_by=20, page_no=page_no
         )
+        context["activity"] = overlay_activity(context["activity"], viewer_overlay(self.request))
         
         return context
 
@@ -91,10 +85,11 @@ class AbstractReleasePage(DetailView):
 
 class ReleaseMainPage(AbstractReleasePage):
     template_name = "release_main.html"
+    recommendation_no = 12
     
     def get_user_actions(self, user, release):
         try:
-            active_actions = user.active_actions.select_related("rate").get(release=release)
+            active_actions = user.active_actions.get(release=release)
             picks = active_actions.picked_tracks() if active_actions else []
             return active_actions, picks
             
@@ -116,6 +111,12 @@ class ReleaseMainPage(AbstractReleasePage):
         _, context["comparison_picks"] \
             = self.get_user_actions(context["comparison_user"], context["release"])
         
+        #Precomputed, see recommendations.neighbours
+        context["recommendations"] = load_release_cards([
+            neighbour.neighbour for neighbour in context["release"].neighbours
+                .select_related("neighbour")[:self.recommendation_no]
+        ], viewer_overlay(self.request))
+        
         return context
 
 class ReleaseActivityPage(AbstractReleasePage):
@@ -181,8 +182,7 @@ class ReleaseViewSet(viewsets.ModelViewSet):
             return Response({"averageRating": release.average_rating()})
         
     def set_release_actions(self, **changes):
-        return self.get_object().active_actions \
-            .update_or_create(user=self.request.user, defaults=changes)[0]
+        return set_active_actions(self.request.user, self.get_object(), **changes)
         
     @action(detail=True, methods=["post"])
     def unsave(self, request, pk=None):
@@ -223,11 +223,106 @@ class TrackViewSet(viewsets.ModelViewSet):
 
 #
 
-class TagPage(DetailView, MultipleObjectMixin):
+class TagIndex(ListView):
+    model = Tag
+    template_name = "tag_index.html"
+    paginate_by = 50
+    #The number of top releases shown for each tag
+    top_release_no = 3
+    
+    def get_queryset(self):
+        #The top releases and related tags are precomputed (see
+        #TagRankingQuerySet.update_rankings and recommendations.related_tags)
+        return Tag.objects.filter(release_count__gt=0).order_by("-release_count", "id") \
+            .prefetch_related(
+                Prefetch(
+                    "rankings", to_attr="top_rankings",
+                    queryset=TagRanking.objects.filter(rank__lte=self.top_release_no).select_related("release")
+                ),
+                Prefetch("related", to_attr="related_tags", queryset=RelatedTag.objects.select_related("other"))
+            )
+        
+class TagPage(DetailView):
     model = Tag
     template_name = "tag.html"
     paginate_by = 30
     
+    def get_rank_param(self, name):
+        try:
+            return int(self.request.GET[name])
+            
+        except (KeyError, ValueError):
+            return None
+        
     def get_context_data(self, **kwargs):
-        releases = self.object.releases.order_by_average_rating()
-        return super().get_context_data(object_list=releases, **kwargs)
+        context = super().get_context_data(**kwargs)
+        
+        rankings = self.object.rankings.select_related("release")
+        
+        #Paged by rank rather than by offset, continuing after the last rank
+        #of the previous page, or before the first rank of the next page.
+        #One more is read to find whether there are more in that direction.
+        after, before = self.get_rank_param("after"), self.get_rank_param("before")
+        
+        if before is not None:
+            page = list(rankings.filter(rank__lt=before).order_by("-rank")[:self.paginate_by + 1])[::-1]
+            has_previous, has_next = len(page) > self.paginate_by, True
+            page = page[-self.paginate_by:]
+            
+        else:
+            page = list(rankings.filter(rank__gt=after or 0)[:self.paginate_by + 1])
+            has_previous, has_next = after is not None, len(page) > self.paginate_by
+            page = page[:self.paginate_by]
+            
+        context["object_list"] = load_release_cards([ranking.release for ranking in page], viewer_overlay(self.request))
+        context["related_tags"] = [related.other for related in self.object.related.select_related("other")]
+        context["previous_rank"] = page[0].rank if page and has_previous else None
+        context["next_rank"] = page[-1].rank if page and has_next else None
+        return context
+        
+class ChartPage(ListView):
+    """The best releases of all time, a decade or a year, as precomputed (see
+       music.charts), optionally of only one type"""
+    
+    template_name = "chart.html"
+    period_pattern = re.compile("^(all-time|[0-9]{3}0s|[0-9]{4})$")
+    #The decades linked to, up to the current one
+    first_decade = 1950
+    
+    def get_type(self):
+        type = self.request.GET.get("type", "")
+        return ReleaseType.get(int(type)) if type.isdigit() else None
+        
+    def get_queryset(self):
+        self.period = self.kwargs.get("period", all_time)
+        
+        if not self.period_pattern.match(self.period):
+            raise Http404
+        
+        entries = ChartEntry.objects.filter(period=self.period, type=self.get_type()) \
+            .select_related("release")
+        
+        for entry in entries:
+            entry.release.average_rating = entry.average_rating
+            
+        return load_release_cards([entry.release for entry in entries], viewer_overlay(self.request))
+        
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        
+        if self.period.endswith("s"):
+            decade = int(self.period[:4])
+            context["period_title"] = "the " + self.period
+            context["years"] = [str(year) for year in range(decade, min(decade + 10, date.today().year + 1))]
+            
+        else:
+            context["period_title"] = "all time" if self.period == all_time else self.period
+            context["years"] = []
+            
+        context["period"] = self.period
+        context["type"] = self.get_type()
+        context["types"] = list(ReleaseType)
+        context["decades"] = [
+            "%ds" % decade for decade in range(self.first_decade, date.today().year + 1, 10)
+        ]
+        return context
@@ -1,5 +1,26 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
+def create_user_indexes(using, **kwargs):
+    """Index usernames for user search. The User model belongs to Django, so
+       these can't be declared as part of the model."""
+    from django.db import connections
+    
+    with connections[using].cursor() as cursor:
+        #Prefix matches, by username__istartswith (using LIKE, which needs text_pattern_ops)
+        cursor.execute(
+            "create index if not exists auth_user_username_upper_like"
+            " on auth_user (upper(username::text) text_pattern_ops)"
+        )
+        #Fuzzy matches (pg_trgm is created by the music app)
+        cursor.execute(
+            "create index if not exists auth_user_username_trgm"
+            " on auth_user using gin (username gin_trgm_ops)"
+        )
+
 class ProfilesConfig(AppConfig):
     name = 'r8music.profiles'
+    
+    def ready(self):
+        post_migrate.connect(create_user_indexes, sender=self)
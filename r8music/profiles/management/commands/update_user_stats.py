@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.profiles.models import update_all_user_stats
+
+class Command(BaseCommand):
+    help = "Recomputes the stats of every user (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_all_user_stats()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
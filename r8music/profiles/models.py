@@ -1,6 +1,10 @@
-from django.db import models
-from django.db.models import Count
+from collections import Counter
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, Q, F, Func, Value, ExpressionWrapper
+from django.db.models.functions import Coalesce, Substr, Sqrt, Greatest
 from django.utils import timezone
+from django.utils.timezone import localtime
 from timezone_field import TimeZoneField
 
 from django.contrib.auth.models import User
@@ -18,13 +22,16 @@ class UserSettings(models.Model):
 class UserProfile(models.Model):
     user = AutoOneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     avatar_url = models.URLField()
+    #Incremented when the user's ratings change, to invalidate what is cached
+    #from them (see recommendations.compatibility)
+    ratings_version = models.IntegerField(default=0)
     
     def follows(self, other_user):
         return Followership.objects.filter(user=other_user, follower=self.user).exists()
         
     def friendships(self):
-        followers = [f.follower for f in self.user.followers.select_related("follower")]
-        following = [f.user for f in self.user.following.select_related("user")]
+        followers = [f.follower for f in self.user.followers.select_related("follower__profile")]
+        following = [f.user for f in self.user.following.select_related("user__profile")]
         
         friends = set(followers + following)
         
@@ -39,14 +46,14 @@ class UserProfile(models.Model):
         return Tag.objects.filter(releases__active_actions__user=self.user)
 
     def favourite_tags(self):
-        tags = self.all_tags.order_by_frequency()
-        tag_ids = [tag.id for tag in tags]
-        global_frequencies = Tag.objects.filter(id__in=tag_ids).frequencies()
-
-        for tag in tags:
-            tag.frequency /= global_frequencies[tag.id] ** (1/2)
-
-        return sorted(tags, key=lambda tag: -tag.frequency)
+        """The tags of the releases the user has acted on, weighed against how
+           common each tag is overall"""
+        #At least one, in case the counts are out of date
+        frequency = Count("releases") / Sqrt(Greatest("release_count", 1))
+        
+        return self.all_tags \
+            .annotate(frequency=ExpressionWrapper(frequency, output_field=models.FloatField())) \
+            .order_by("-frequency")
 
 class UserRatingDescription(models.Model):
     """The description of this rating displayed on the user's profile page"""
@@ -58,3 +65,178 @@ class Followership(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="followers")
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
     creation = models.DateTimeField(default=timezone.now)
+
+def local_month(field):
+    """The month of a datetime field as "YYYY-MM", in the timezone of the user
+       of each row, in SQL"""
+    user_timezone = Coalesce(
+        "user__settings__timezone", Value(UserSettings._meta.get_field("timezone").default),
+        output_field=models.TextField()
+    )
+    
+    return Func(
+        Func(user_timezone, F(field), function="timezone"),
+        Value("YYYY-MM"), function="to_char", output_field=models.TextField()
+    )
+    
+class UserStats(models.Model):
+    """A snapshot of the statistics shown on a user's profile: the number of
+       releases they rated, listened to or saved, of releases by rating, of
+       releases listened to by release year and by the month listened. Kept
+       up to date as the user acts (see actions.models.set_active_actions),
+       and computed from scratch when missing."""
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="stats")
+    #Each a dict of counts, by rating, year and "YYYY-MM" (as strings)
+    ratings = models.JSONField(default=dict)
+    release_years = models.JSONField(default=dict)
+    listen_months = models.JSONField(default=dict)
+    #With the keys "rated", "listened_unrated" and "saved"
+    actions = models.JSONField(default=dict)
+    
+    count_fields = ["ratings", "release_years", "listen_months", "actions"]
+    
+    @staticmethod
+    def contribution(active_actions, timezone):
+        """The counts added to a user's stats by their active actions on one
+           release, as a Counter of (field, key). Listens are counted by month
+           in the user's timezone."""
+        counts = Counter()
+        
+        if active_actions is None:
+            return counts
+            
+        if active_actions.rating is not None:
+            counts["ratings", str(active_actions.rating)] += 1
+            counts["actions", "rated"] += 1
+            
+        elif active_actions.listen:
+            counts["actions", "listened_unrated"] += 1
+            
+        if active_actions.save_action_id:
+            counts["actions", "saved"] += 1
+            
+        if active_actions.listen:
+            release_date = active_actions.release.release_date
+            
+            if release_date:
+                counts["release_years", release_date[:4]] += 1
+                
+            month = localtime(active_actions.listen.creation, timezone).strftime("%Y-%m")
+            counts["listen_months", month] += 1
+            
+        return counts
+        
+    def add(self, counts):
+        for (field, key), n in counts.items():
+            field_counts = getattr(self, field)
+            field_counts[key] = field_counts.get(key, 0) + n
+            
+            if not field_counts[key]:
+                del field_counts[key]
+                
+    @staticmethod
+    def compute(active_actions):
+        """The stats of the users of the given active actions, grouped and
+           counted in the database, as {user id: UserStats}"""
+        all_stats = {}
+        stats_of = lambda user_id: all_stats.setdefault(user_id, UserStats(user_id=user_id))
+        
+        for user_id, rating, n in active_actions.exclude(rating=None) \
+            .values_list("user_id", "rating").annotate(n=Count("id")):
+            stats_of(user_id).ratings[str(rating)] = n
+            
+        listened = active_actions.exclude(listen=None)
+        
+        for user_id, year, n in listened \
+            .exclude(release__release_date=None).exclude(release__release_date="") \
+            .values_list("user_id", Substr("release__release_date", 1, 4)).annotate(n=Count("id")):
+            stats_of(user_id).release_years[year] = n
+            
+        for user_id, month, n in listened \
+            .values_list("user_id", local_month("listen__creation")).annotate(n=Count("id")):
+            stats_of(user_id).listen_months[month] = n
+            
+        for user_id, *counts in active_actions.values_list("user_id").annotate(
+            rated=Count("id", filter=~Q(rate=None)),
+            listened_unrated=Count("id", filter=~Q(listen=None) & Q(rate=None)),
+            saved=Count("id", filter=~Q(save_action=None))
+        ):
+            stats_of(user_id).actions = {
+                key: n for key, n in zip(["rated", "listened_unrated", "saved"], counts) if n
+            }
+            
+        return all_stats
+        
+    def refresh(self, save=True):
+        """Recompute the stats from all of the user's active actions"""
+        computed = UserStats.compute(self.user.active_actions.all()).get(self.user_id, UserStats())
+        
+        for field in UserStats.count_fields:
+            setattr(self, field, getattr(computed, field))
+            
+        if save:
+            self.save()
+            
+        return self
+        
+    @staticmethod
+    def of(user):
+        """The stats of a user, computed if missing"""
+        try:
+            return user.stats
+            
+        except UserStats.DoesNotExist:
+            pass
+            
+        with transaction.atomic():
+            #Locked as in set_active_actions, so that no actions are applied while
+            #the stats are computed, and they're only computed once at a time
+            User.objects.select_for_update(no_key=True).filter(id=user.id).first()
+            stats = UserStats.objects.filter(user=user).first()
+            
+            if stats:
+                return stats
+                
+            stats = UserStats(user=user).refresh(save=False)
+            
+            try:
+                with transaction.atomic():
+                    stats.save()
+                    return stats
+                    
+            except IntegrityError:
+                #Created by update_all_user_stats in the meantime
+                return UserStats.objects.get(user=user)
+
+def update_all_user_stats(chunk_size=1000):
+    """Recompute the stats of every user (after actions are imported in bulk,
+       or periodically in case any were changed without updating them). A chunk
+       of users at a time is locked, as in set_active_actions, and their stats
+       computed and updated in place, so that no actions are applied in between."""
+    #(Imported here as the actions depend on these models)
+    from r8music.actions.models import ActiveActions
+    
+    user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+    
+    for start in range(0, len(user_ids), chunk_size):
+        with transaction.atomic():
+            #Locked in order, so as not to deadlock with another update
+            chunk = list(
+                User.objects.select_for_update(no_key=True)
+                    .filter(id__in=user_ids[start:start + chunk_size])
+                    .order_by("id").values_list("id", flat=True)
+            )
+            
+            computed = UserStats.compute(ActiveActions.objects.filter(user_id__in=chunk))
+            existing = dict(UserStats.objects.filter(user_id__in=chunk).values_list("user_id", "id"))
+            
+            all_stats = [computed.get(user_id, UserStats(user_id=user_id)) for user_id in chunk]
+            
+            for stats in all_stats:
+                stats.id = existing.get(stats.user_id)
+                
+            UserStats.objects.bulk_update(
+                [stats for stats in all_stats if stats.id], UserStats.count_fields, batch_size=chunk_size
+            )
+            UserStats.objects.bulk_create([stats for stats in all_stats if not stats.id], batch_size=chunk_size)
@@ -1,9 +1,18 @@
 import requests_mock
+from unittest import mock
+from datetime import datetime, timezone
 
 from django.test import TestCase
 from django.urls import reverse
+from django.db.models import Count
 from django.contrib.auth.models import User
 
+from r8music.testing import QueryBudgetTestCase
+from r8music.music.models import Release, Tag
+from r8music.actions.models import SaveAction, ListenAction, RateAction, enact, set_active_actions
+from .models import UserStats, update_all_user_stats
+from .urls import url_for_user
+
 class SettingsTest(TestCase):
     def test_validation(self):
         def test_form_response(response, expected_errors):
@@ -53,3 +62,139 @@ class SettingsTest(TestCase):
             {"avatar_url": mock_404_url}, {"profile_form": ["avatar_url"]},
             extra_request_mock=lambda mock: mock.head(mock_404_url, status_code=404)
         )
+
+class StatsTest(TestCase):
+    def test_incremental_stats(self):
+        user = User.objects.create_user("user")
+        ok_computer, kid_a, ten = [
+            Release.objects.create(title=title, slug=title.lower(), release_date=date)
+            for title, date in [("OK Computer", "1997-05-21"), ("Kid A", "2000-10-02"), ("Ten", None)]
+        ]
+        
+        stats = UserStats.of(user)
+        
+        enact(SaveAction.objects.create(user=user, release=ten))
+        enact(RateAction.objects.create(user=user, release=ok_computer, rating=8))
+        enact(RateAction.objects.create(user=user, release=kid_a, rating=7))
+        enact(ListenAction.objects.create(user=user, release=ten))
+        set_active_actions(user, kid_a, rate=None)
+        set_active_actions(user, ok_computer, listen=None)
+        
+        stats.refresh_from_db()
+        
+        self.assertEqual(stats.ratings, {"8": 1})
+        self.assertEqual(stats.release_years, {"2000": 1})
+        self.assertEqual(stats.actions, {"rated": 1, "listened_unrated": 2})
+        self.assertEqual(sum(stats.listen_months.values()), 2)
+        
+        #The same as when computed from scratch
+        fields = lambda stats: (stats.ratings, stats.release_years, stats.listen_months, stats.actions)
+        incremental = fields(stats)
+        self.assertEqual(fields(stats.refresh()), incremental)
+        
+    def test_created_concurrently(self):
+        user = User.objects.create_user("user")
+        release = Release.objects.create(title="Release", slug="release")
+        enact(RateAction.objects.create(user=user, release=release, rating=8))
+        
+        refresh = UserStats.refresh
+        
+        def refresh_after_update_all(stats, **kwargs):
+            #As if all the stats were recomputed since these were found missing
+            update_all_user_stats()
+            return refresh(stats, **kwargs)
+            
+        with mock.patch.object(UserStats, "refresh", refresh_after_update_all):
+            stats = UserStats.of(user)
+            
+        self.assertEqual(stats, UserStats.objects.get(user=user))
+        self.assertEqual(stats.ratings, {"8": 1})
+        
+    def test_update_all(self):
+        user, other = [User.objects.create_user(name) for name in ["user", "other"]]
+        release = Release.objects.create(title="Release", slug="release")
+        stats = UserStats.of(user)
+        
+        enact(RateAction.objects.create(user=user, release=release, rating=8))
+        UserStats.objects.filter(user=user).update(ratings={})
+        update_all_user_stats(chunk_size=1)
+        
+        #Updated in place, and created for the others
+        self.assertEqual(UserStats.objects.get(user=user).id, stats.id)
+        self.assertEqual(UserStats.objects.get(user=user).ratings, {"8": 1})
+        self.assertEqual(UserStats.objects.get(user=other).ratings, {})
+        
+    def test_deleted_concurrently(self):
+        user = User.objects.create_user("user")
+        release = Release.objects.create(title="Release", slug="release")
+        UserStats.of(user)
+        
+        add = UserStats.add
+        
+        def add_after_delete(stats, counts):
+            #As if the stats were deleted since being read (e.g. by changing timezone)
+            UserStats.objects.filter(user=user).delete()
+            return add(stats, counts)
+            
+        with mock.patch.object(UserStats, "add", add_after_delete):
+            enact(RateAction.objects.create(user=user, release=release, rating=8))
+            
+        self.assertFalse(UserStats.objects.filter(user=user).exists())
+        self.assertEqual(UserStats.of(User.objects.get(id=user.id)).ratings, {"8": 1})
+        
+    def test_listen_months(self):
+        user = User.objects.create_user("user")
+        user.settings.timezone = "America/New_York"
+        user.settings.save()
+        
+        for n, creation in enumerate([
+            #The previous evening in New York
+            datetime(2020, 1, 1, 2, tzinfo=timezone.utc),
+            datetime(2020, 3, 15, tzinfo=timezone.utc)
+        ]):
+            release = Release.objects.create(title="Release %d" % n, slug="release-%d" % n)
+            enact(ListenAction.objects.create(user=user, release=release, creation=creation))
+            
+        response = self.client.get(url_for_user(user, "user_stats"))
+        
+        self.assertEqual(response.context_data["listen_month_counts"], (
+            ["2019-12", "2020-01", "2020-02", "2020-03"], [1, 0, 0, 1]
+        ))
+        
+class FavouriteTagsTest(TestCase):
+    def test_favourite_tags(self):
+        user = User.objects.create_user("user")
+        rock, ambient = [Tag.objects.create(name=name) for name in ["rock", "ambient"]]
+        
+        for n in range(9):
+            release = Release.objects.create(title="Release %d" % n, slug="release-%d" % n)
+            release.tags.add(rock, *([ambient] if n == 0 else []))
+            
+            if n < 2:
+                enact(ListenAction.objects.create(user=user, release=release))
+                
+        Tag.objects.update_release_counts()
+        self.assertEqual(Tag.objects.frequencies(), {rock.id: 9, ambient.id: 1})
+        
+        #Rock is common, so one release tagged ambient outweighs two tagged rock
+        favourite_tags = user.profile.favourite_tags()
+        self.assertEqual([tag.name for tag in favourite_tags], ["ambient", "rock"])
+        self.assertAlmostEqual(favourite_tags[1].frequency, 2/9**(1/2))
+        
+class QueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        users = User.objects.annotate(n=Count("active_actions")).order_by("-n", "id")
+        #The heaviest user's pages, viewed by another user
+        self.user, viewer = users[:2]
+        self.client.force_login(viewer)
+        
+    def test_user_pages(self):
+        for route, max_queries in [
+            ("user_main", 16),
+            ("user_listened_unrated", 13),
+            ("user_saved", 13),
+            ("user_activity", 20),
+            ("user_friends", 15),
+            ("user_stats", 10)
+        ]:
+            self.assertWithinBudget(url_for_user(self.user, route), max_queries)
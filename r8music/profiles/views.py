@@ -1,6 +1,5 @@
 import requests
 from itertools import groupby
-from collections import Counter
 from urllib.parse import urlparse
 
 from django.views.generic import TemplateView, DetailView, ListView, CreateView
@@ -19,17 +18,17 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from captcha.fields import ReCaptchaField
 
-from django.db.models import Count, Q
-
 from django.contrib.auth.models import User
-from r8music.profiles.models import UserSettings, UserProfile, UserRatingDescription
+from r8music.profiles.models import UserSettings, UserProfile, UserRatingDescription, UserStats
 from r8music.music.models import Release
+from r8music.music.cards import load_release_cards
+from r8music.actions.overlay import viewer_overlay, overlay_activity
 from r8music.actions.models import get_paginated_activity_feed
+from r8music.recommendations.compatibility import \
+    get_compatibility, get_compatibilities, schedule_update_compatibilities
 
 from django.urls import reverse_lazy
 
-from r8music.utils import uniqify
-
 class UserIndex(ListView):
     model = User
     template_name = "user_index.html"
@@ -48,15 +47,21 @@ class AbstractUserPage(DetailView):
         
     def add_actions_counts(self, context):
         """Adds the number of releases interacted with in certain ways by a user."""
-        context["action_counts"] = context["user"].active_actions.aggregate(
-            rated=Count("id", filter=~Q(rate=None)),
-            listened_unrated=Count("id", filter=~Q(listen=None) & Q(rate=None)),
-            saved=Count("id", filter=~Q(save_action=None))
-        )
+        context["action_counts"] = {
+            key: context["stats"].actions.get(key, 0)
+            for key in ["rated", "listened_unrated", "saved"]
+        }
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context["stats"] = UserStats.of(context["user"])
         self.add_actions_counts(context)
+        
+        #Of the user viewing the page with this user
+        viewer = self.request.user
+        context["compatibility"] = get_compatibility(viewer, context["user"]) \
+            if not viewer.is_anonymous and viewer != context["user"] else None
+        
         return context
         
 class UserMainPage(AbstractUserPage):
@@ -66,10 +71,11 @@ class UserMainPage(AbstractUserPage):
         #The user whose profile is being viewed
         user = context["user"]
         
-        releases_rated = Release.objects \
-            .rated_by_user(user) \
-            .order_by("-rating_by_user", "artists__name", "release_date") \
-            .prefetch_related("artists")
+        releases_rated = load_release_cards(
+            Release.objects.rated_by_user(user)
+                .order_by("-rating_by_user", "artists__name", "release_date"),
+            viewer_overlay(self.request)
+        )
         
         descriptions = {desc.rating: desc.description for desc in user.profile.rating_descriptions.all()}
         
@@ -81,31 +87,23 @@ class UserMainPage(AbstractUserPage):
             for rating, releases in groupby(releases_rated, lambda r: r.rating_by_user)
         ]
         
-        rated_by_request_user = Release.objects \
-            .rated_by_user(self.request.user) \
-            .in_bulk([r.id for r in releases_rated]) \
-            if not self.request.user.is_anonymous else {}
-        
-        context["get_user_rating"] = lambda release: rated_by_request_user[release.id].rating_by_user \
-            if release.id in rated_by_request_user else None
-        
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         self.add_releases_rated_data(context)
         return context
 
-def group_by_action_time(qs, timestamp_field):
+def group_by_action_time(qs, timestamp_field, viewer):
     # Group and display by "natural" time i.e. "X time periods ago"
     time = lambda r: naturaltime(getattr(r, timestamp_field))
-    return groupby(qs.order_by("-" + timestamp_field), time)
+    return groupby(load_release_cards(qs.order_by("-" + timestamp_field), viewer), time)
 
 class UserListenedUnratedPage(AbstractUserPage):
     template_name = "user_listened_unrated.html"
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        releases = Release.objects.listened_unrated_by_user(context["user"]).prefetch_related("artists")
-        context["listened_unrated"] = group_by_action_time(releases, "listen_timestamp")
+        releases = Release.objects.listened_unrated_by_user(context["user"])
+        context["listened_unrated"] = group_by_action_time(releases, "listen_timestamp", viewer_overlay(self.request))
         return context
 
 class UserSavedPage(AbstractUserPage):
@@ -114,7 +112,7 @@ class UserSavedPage(AbstractUserPage):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         releases = Release.objects.saved_by_user(context["user"])
-        context["saved"] = group_by_action_time(releases, "save_timestamp")
+        context["saved"] = group_by_action_time(releases, "save_timestamp", viewer_overlay(self.request))
         return context
 
 class UserActivityPage(AbstractUserPage):
@@ -132,6 +130,7 @@ class UserActivityPage(AbstractUserPage):
             lambda track_actions: track_actions.filter(pk=None),
             paginate_by=20, page_no=page_no
         )
+        context["activity"] = overlay_activity(context["activity"], viewer_overlay(self.request))
         
         return context
 
@@ -141,6 +140,7 @@ class UserFriendsPage(AbstractUserPage):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["friends"] = context["user"].profile.friendships()
+        context["compatibilities"] = get_compatibilities(context["user"], context["friends"])
         return context
 
 class UserStatsPage(AbstractUserPage):
@@ -149,25 +149,14 @@ class UserStatsPage(AbstractUserPage):
     def add_rating_counts(self, context):
         """Adds the counts of releases given each rating by a user."""
         
-        rating_counts = context["user"].active_actions.aggregate(**{
-            ("rated_%d" % n): Count("id", filter=Q(rate__rating=n))
-            for n in range(1, 8+1)
-        })
-        
         context["rating_counts"] = \
-            [rating_counts["rated_%d" % n] for n in range(1, 8+1)]
+            [context["stats"].ratings.get(str(n), 0) for n in range(1, 8+1)]
         
     def add_release_year_counts(self, context):
         """Adds the counts of releases listened to by a user for each year between
            the years of the earliest and latest releases, as ([years], [counts])."""
         
-        release_dates = context["user"].active_actions \
-            .exclude(listen=None) \
-            .order_by("release__release_date") \
-            .values_list("release__release_date", flat=True)
-        release_years = [int(date[:4]) for date in release_dates if date]
-        
-        year_counts = Counter(release_years)
+        year_counts = {int(year): n for year, n in context["stats"].release_years.items()}
         
         range_of = lambda iterable: \
             range(min(iterable), max(iterable)+1) if iterable else []
@@ -177,18 +166,18 @@ class UserStatsPage(AbstractUserPage):
             (year_range, [year_counts.get(year, 0) for year in year_range])
         
     def add_listen_month_counts(self, context):
-        """Adds counts of the releases, by month they were listened to."""
+        """Adds counts of the releases, by month they were listened to (in the
+           user's timezone), for each month between the first and the last
+           listens, as (["YYYY-MM"], [counts])."""
 
-        listen_dates = context["user"].active_actions \
-            .exclude(listen=None) \
-            .order_by("listen__creation") \
-            .values_list("listen__creation", flat=True)
-        listen_months = [date.isoformat()[:7] for date in listen_dates]
-
-        counts = Counter(listen_months)
-        keys = uniqify(listen_months)
+        counts = context["stats"].listen_months
+        
+        #As a number of months since year 0, to count through
+        months = [int(month[:4])*12 + int(month[5:]) - 1 for month in counts.keys()]
+        month_range = range(min(months), max(months)+1) if months else []
+        keys = ["%04d-%02d" % (month // 12, month % 12 + 1) for month in month_range]
 
-        context["listen_month_counts"] = (keys, [counts[key] for key in keys])
+        context["listen_month_counts"] = (keys, [counts.get(key, 0) for key in keys])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -205,6 +194,7 @@ class FollowUser(AbstractUserPage, LoginRequiredMixin):
     
     def post(self, request, **kwargs):
         request.user.following.get_or_create(user=self.get_object())
+        schedule_update_compatibilities(request.user.id)
         return redirect(request.POST.get("next"))
 
 class UnfollowUser(AbstractUserPage, LoginRequiredMixin):
@@ -213,6 +203,7 @@ class UnfollowUser(AbstractUserPage, LoginRequiredMixin):
     
     def post(self, request, **kwargs):
         request.user.following.filter(user=self.get_object()).delete()
+        schedule_update_compatibilities(request.user.id)
         return redirect(request.POST.get("next"))
 
 #
@@ -327,6 +318,10 @@ class SettingsPage(LoginRequiredMixin, TemplateView):
             try:
                 form.save()
                 
+                #Listens are counted by the month in the user's timezone
+                if isinstance(form, SettingsForm) and "timezone" in form.changed_data:
+                    UserStats.objects.filter(user=request.user).delete()
+                
             except ValueError:
                 errors = True
                 
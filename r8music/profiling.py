@@ -0,0 +1,231 @@
+import re, logging
+from time import perf_counter
+from threading import Lock
+from contextlib import ExitStack
+from collections import Counter, defaultdict
+
+from django.db import connections
+from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+
+logger = logging.getLogger(__name__)
+
+#Lists of parameters (e.g. from in_bulk) vary in length but not in shape
+sql_param_list_pattern = re.compile(r"\((?:%s, )*%s\)")
+
+def query_shape(sql):
+    return sql_param_list_pattern.sub("(...)", sql)
+
+class QueryLog:
+    """Records the SQL queries executed, on every database connection, while
+       used as a context manager. Each query is stored as (sql, duration)."""
+
+    def __init__(self):
+        self.queries = []
+        self.exit_stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+
+        finally:
+            self.queries.append((sql, perf_counter() - start))
+
+    def __enter__(self):
+        self.exit_stack = ExitStack()
+
+        for connection in connections.all():
+            self.exit_stack.enter_context(connection.execute_wrapper(self))
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self.exit_stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _sql, duration in self.queries)
+
+    def duplicates(self, since=0):
+        """The query shapes which were executed more than once, with their counts.
+           Repeated shapes are the signature of an N+1 query."""
+        counts = Counter(query_shape(sql) for sql, _duration in self.queries[since:])
+        return {shape: n for shape, n in counts.items() if n > 1}
+
+class RequestProfile:
+    """The timings of one request, divided into the view (up to the point the
+       response is returned) and template rendering. Templates rendered by the
+       view itself, rather than through a TemplateResponse, count as view time."""
+
+    def __init__(self):
+        self.query_log = QueryLog()
+        self.start = perf_counter()
+        self.view_start = self.view_end = self.render_end = None
+        #The number of queries made before rendering began
+        self.queries_before_render = None
+
+    def start_view(self):
+        self.view_start = perf_counter()
+
+    def end_view(self):
+        self.view_end = perf_counter()
+        self.queries_before_render = len(self.query_log)
+
+    def end_render(self):
+        self.render_end = perf_counter()
+
+    def finish(self):
+        self.end = perf_counter()
+
+        if self.view_end is None:
+            self.end_view()
+
+    @property
+    def durations(self):
+        """Durations in milliseconds, of the phases that occurred"""
+        ms = lambda start, end: (end - start) * 1000
+
+        durations = {}
+
+        if self.view_start is not None:
+            durations["view"] = ms(self.view_start, self.view_end)
+
+        if self.render_end is not None:
+            durations["render"] = ms(self.view_end, self.render_end)
+
+        durations["db"] = self.query_log.total_time * 1000
+        durations["total"] = ms(self.start, self.end)
+
+        return durations
+
+    @property
+    def render_queries(self):
+        return len(self.query_log) - self.queries_before_render
+
+    def server_timing(self):
+        durations = self.durations
+
+        descriptions = {
+            "db": "%d queries, %d duplicated shapes"
+                % (len(self.query_log), len(self.query_log.duplicates())),
+            "render": "%d queries" % self.render_queries
+        }
+
+        return ", ".join(
+            '%s;dur=%.1f' % (name, duration)
+                + (';desc="%s"' % descriptions[name] if name in descriptions else "")
+            for name, duration in durations.items()
+        )
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.max_queries = 0
+        self.render_queries = 0
+        self.duplicated_requests = 0
+        self.durations = defaultdict(float)
+        self.max_total = 0
+
+    def add(self, profile):
+        durations = profile.durations
+
+        self.requests += 1
+        self.queries += len(profile.query_log)
+        self.max_queries = max(self.max_queries, len(profile.query_log))
+        self.render_queries += profile.render_queries
+        self.duplicated_requests += bool(profile.query_log.duplicates())
+        self.max_total = max(self.max_total, durations["total"])
+
+        for name, duration in durations.items():
+            self.durations[name] += duration
+
+    def report(self):
+        mean = lambda total: total / self.requests
+
+        return {
+            "requests": self.requests,
+            "mean_queries": mean(self.queries),
+            "max_queries": self.max_queries,
+            "mean_render_queries": mean(self.render_queries),
+            #The proportion of requests which repeated a query shape
+            "duplicated_query_rate": mean(self.duplicated_requests),
+            "mean_ms": {name: mean(total) for name, total in self.durations.items()},
+            "max_total_ms": self.max_total
+        }
+
+class RouteReport:
+    """Aggregates request profiles by route. The report belongs to the process,
+       so each worker collects its own."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.routes = defaultdict(RouteStats)
+
+    def add(self, route, profile):
+        with self.lock:
+            self.routes[route].add(profile)
+
+    def report(self):
+        with self.lock:
+            return {route: stats.report() for route, stats in self.routes.items()}
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+
+route_report = RouteReport()
+
+def route_name(request):
+    match = request.resolver_match
+    return match.view_name or match.route if match else None
+
+class RequestProfilingMiddleware:
+    """Profiles SQL queries, view and template render time for each request.
+       The results are given in a Server-Timing header (visible in browser
+       developer tools) and are aggregated into `route_report`.
+
+       Opt-in, with settings.PROFILE_REQUESTS. Should come first in
+       settings.MIDDLEWARE so that the total covers the other middleware."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profile = profile = RequestProfile()
+
+        with profile.query_log:
+            response = self.get_response(request)
+
+        profile.finish()
+
+        response["Server-Timing"] = profile.server_timing()
+
+        route = route_name(request)
+
+        if route:
+            route_report.add(route, profile)
+
+        logger.debug("%s %s", request.path, profile.server_timing())
+
+        for shape, n in profile.query_log.duplicates().items():
+            logger.debug("Query executed %d times: %s", n, shape)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile.start_view()
+
+    def process_template_response(self, request, response):
+        request.profile.end_view()
+        response.add_post_render_callback(lambda response: request.profile.end_render())
+        return response
+
+@staff_member_required
+def profiling_report(request):
+    return JsonResponse(route_report.report())
@@ -0,0 +1,196 @@
+"""Taste compatibility between users, from the correlation of their ratings of
+   the releases they both rated, and the overlap of their favourite tags (as
+   in UserProfile.favourite_tags).
+
+   Stored for the pairs of users where one follows the other, as these are
+   shown on friends lists, and otherwise computed on demand and cached. The
+   cached scores of a user are invalidated when they rate a release, by
+   incrementing the version of their ratings, which is included in the keys.
+   The versions are kept in the database (UserProfile.ratings_version) rather
+   than the cache, so that every process sees them even if the cache isn't
+   shared between processes (as the default, in-memory cache isn't)."""
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+from django.db.models import Count, Q, F, OuterRef, Subquery
+from django.core.cache import cache
+from background_task import background
+
+from django.contrib.auth.models import User
+from r8music.music.models import Release
+from r8music.actions.models import ActiveActions
+from r8music.profiles.models import Followership, UserProfile
+from .models import Compatibility
+
+#The correlation is shrunk towards zero by n/(n + shrinkage), for n releases
+#rated by both users, so that a few releases in common aren't trusted much
+shrinkage = 5
+#The weight of the ratings, with the rest given to the tags
+rating_weight = 0.7
+
+class Tastes:
+    """The ratings and favourite tags of some users, as sparse matrices with a
+       row for each user"""
+
+    def __init__(self, user_ids):
+        self.user_ids = np.unique(np.array(list(user_ids), dtype=int))
+
+        active_actions = ActiveActions.objects.filter(user_id__in=self.user_ids.tolist())
+        taggings = Release.tags.through.objects \
+            .filter(release__active_actions__user_id__in=self.user_ids.tolist())
+
+        ratings = np.array(
+            list(active_actions.exclude(rating=None).values_list("user_id", "release_id", "rating")),
+            dtype=int
+        ).reshape(-1, 3)
+
+        #The number of the user's releases with each tag, and of all releases
+        tag_counts = np.array(
+            list(taggings.values_list("release__active_actions__user_id", "tag_id", "tag__release_count")
+                .annotate(n=Count("id"))),
+            dtype=int
+        ).reshape(-1, 4)
+
+        release_ids, releases = np.unique(ratings[:, 1], return_inverse=True)
+        tag_ids, tags = np.unique(tag_counts[:, 1], return_inverse=True)
+
+        matrix = lambda rows, columns, values, column_no: sparse.csr_matrix(
+            (values, (np.searchsorted(self.user_ids, rows), columns)),
+            shape=(len(self.user_ids), column_no)
+        )
+
+        self.ratings = matrix(ratings[:, 0], releases, ratings[:, 2].astype(float), len(release_ids))
+        self.rated = matrix(ratings[:, 0], releases, np.ones(len(ratings)), len(release_ids))
+
+        self.tags = matrix(
+            tag_counts[:, 0], tags,
+            tag_counts[:, 3] / np.sqrt(np.maximum(tag_counts[:, 2], 1)),
+            len(tag_ids)
+        )
+
+    def rows(self, user_ids):
+        return np.searchsorted(self.user_ids, user_ids)
+
+    def compatibility(self, pairs):
+        """The compatibility of each pair of user ids, from 0 to 1"""
+        pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+        a, b = self.rows(pairs[:, 0]), self.rows(pairs[:, 1])
+
+        #Row-wise dot products, of the rows of a with the rows of b
+        dot = lambda x, y: np.asarray(x[a].multiply(y[b]).sum(axis=1)).ravel()
+        dot_reversed = lambda x, y: np.asarray(x[b].multiply(y[a]).sum(axis=1)).ravel()
+
+        squares = self.ratings.multiply(self.ratings).tocsr()
+
+        #Sums over only the releases rated by both
+        n = dot(self.rated, self.rated)
+        sum_a, sum_b = dot(self.ratings, self.rated), dot_reversed(self.ratings, self.rated)
+        squares_a, squares_b = dot(squares, self.rated), dot_reversed(squares, self.rated)
+        products = dot(self.ratings, self.ratings)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            covariance = n*products - sum_a*sum_b
+            variance = np.sqrt((n*squares_a - sum_a**2) * (n*squares_b - sum_b**2))
+            #Zero when undefined (no releases in common, or all rated the same)
+            correlation = np.nan_to_num(covariance / variance) * n/(n + shrinkage)
+
+            norms = np.sqrt(np.asarray(self.tags.multiply(self.tags).sum(axis=1)).ravel())
+            tag_similarity = np.nan_to_num(dot(self.tags, self.tags) / (norms[a] * norms[b]))
+
+        return rating_weight*(correlation + 1)/2 + (1 - rating_weight)*tag_similarity
+
+def follow_pairs(user_id=None):
+    """Each pair of users where one follows the other, once"""
+    follows = Followership.objects.all()
+
+    if user_id is not None:
+        follows = follows.filter(Q(user_id=user_id) | Q(follower_id=user_id))
+
+    return list({
+        tuple(sorted(pair)) for pair in follows.values_list("user_id", "follower_id")
+    })
+
+def store_compatibilities(tastes, pairs):
+    #Both ways round, so they can be looked up by either user. Updates can overlap
+    #(in the worker's threads, or the command alongside a task), in which case
+    #the pairs stored by the other are kept, as they were computed alike.
+    Compatibility.objects.bulk_create([
+        Compatibility(user_id=user_id, other_id=other_id, score=score)
+        for (a, b), score in zip(pairs, tastes.compatibility(pairs))
+        for user_id, other_id in [(a, b), (b, a)]
+    ], batch_size=10000, ignore_conflicts=True)
+
+def update_all_compatibilities():
+    pairs = follow_pairs()
+    tastes = Tastes({id for pair in pairs for id in pair})
+
+    with transaction.atomic():
+        Compatibility.objects.all().delete()
+        store_compatibilities(tastes, pairs)
+
+def update_compatibilities(user_id):
+    """Recompute the compatibilities of one user with those they follow, or
+       who follow them"""
+    pairs = follow_pairs(user_id)
+    tastes = Tastes({id for pair in pairs for id in pair})
+
+    with transaction.atomic():
+        Compatibility.objects.filter(Q(user_id=user_id) | Q(other_id=user_id)).delete()
+        store_compatibilities(tastes, pairs)
+
+#Delayed, so that ratings in quick succession only cause one update
+@background(schedule=60, remove_existing_tasks=True)
+def schedule_update_compatibilities(user_id):
+    update_compatibilities(user_id)
+
+def ratings_changed(user_id):
+    """Invalidate the cached compatibilities of a user, and update those stored"""
+    if not UserProfile.objects.filter(user_id=user_id).update(ratings_version=F("ratings_version") + 1):
+        UserProfile.objects.get_or_create(user_id=user_id, defaults={"ratings_version": 1})
+
+    schedule_update_compatibilities(user_id)
+
+def get_compatibilities(user, others, timeout=60*60):
+    """The compatibility of a user with each of the others, as {user id: score}.
+       Stored, cached or otherwise computed (all at once)."""
+    other_ids = [other.id for other in others]
+
+    #The versions of the ratings of each, and the stored scores, in one query
+    stored = Compatibility.objects.filter(user=user, other=OuterRef("id")).values("score")[:1]
+    rows = list(
+        User.objects.filter(id__in=[user.id] + other_ids)
+            .values_list("id", "profile__ratings_version", Subquery(stored))
+    )
+
+    versions = {id: version or 0 for id, version, _score in rows}
+    compatibilities = {id: score for id, _version, score in rows if id in other_ids and score is not None}
+
+    missing = [id for id in other_ids if id not in compatibilities]
+
+    if not missing:
+        return compatibilities
+
+    keys = {
+        id: "compatibility:%d:%d:%d:%d" % (user.id, versions.get(user.id, 0), id, versions.get(id, 0))
+        for id in missing
+    }
+
+    cached = cache.get_many(keys.values())
+    compatibilities.update({id: cached[key] for id, key in keys.items() if key in cached})
+
+    missing = [id for id in missing if keys[id] not in cached]
+
+    if missing:
+        pairs = [(user.id, id) for id in missing]
+        scores = Tastes([user.id] + missing).compatibility(pairs)
+
+        computed = dict(zip(missing, scores.tolist()))
+        cache.set_many({keys[id]: score for id, score in computed.items()}, timeout)
+        compatibilities.update(computed)
+
+    return compatibilities
+
+def get_compatibility(user, other):
+    return get_compatibilities(user, [other])[other.id]
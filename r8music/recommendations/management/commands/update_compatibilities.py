@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.recommendations.compatibility import update_all_compatibilities
+
+class Command(BaseCommand):
+    help = "Recomputes the taste compatibility of every pair of users where one follows the other (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_all_compatibilities()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.recommendations.personal import update_all_recommendations
+
+class Command(BaseCommand):
+    help = "Recomputes the personal recommendations of every user (run periodically, after update_release_neighbours)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_all_recommendations()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
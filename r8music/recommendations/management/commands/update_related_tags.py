@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.recommendations.related_tags import update_related_tags
+
+class Command(BaseCommand):
+    help = "Recomputes the related tags of every tag, from the releases they share (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_related_tags()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
@@ -0,0 +1,13 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from r8music.recommendations.neighbours import update_all_neighbours
+
+class Command(BaseCommand):
+    help = "Recomputes the recommended neighbours of every release (run periodically)"
+    
+    def handle(self, **options):
+        start = perf_counter()
+        update_all_neighbours()
+        self.stdout.write("Done in %.1fs" % (perf_counter() - start))
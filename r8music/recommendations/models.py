@@ -0,0 +1,62 @@
+from django.db import models
+
+from django.contrib.auth.models import User
+from r8music.music.models import Release, Tag
+
+class ReleaseNeighbour(models.Model):
+    """A release liked by the listeners of another release, stored for the
+       top few neighbours of each release (see neighbours.py)"""
+    
+    release = models.ForeignKey(Release, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(Release, on_delete=models.CASCADE, related_name="+")
+    #The lower bound of the proportion of listeners who liked the neighbour
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ["-score"]
+        constraints = [
+            #So that overlapping updates can't store a neighbour twice (see store_neighbours)
+            models.UniqueConstraint(
+                fields=["release", "neighbour"], name="releaseneighbour_release_neighbour_uniq"
+            )
+        ]
+        indexes = [models.Index(fields=["release", "-score"])]
+
+class UserRecommendation(models.Model):
+    """A release recommended to a user, stored for the top few of each user
+       (see personal.py)"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="recommendations")
+    release = models.ForeignKey(Release, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ["-score"]
+        indexes = [models.Index(fields=["user", "-score"])]
+
+class Compatibility(models.Model):
+    """The taste compatibility of two users, from 0 to 1, stored (both ways
+       round) for pairs where one follows the other (see compatibility.py)"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    other = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    
+    class Meta:
+        constraints = [
+            #So that overlapping updates can't store a pair twice (see store_compatibilities)
+            models.UniqueConstraint(fields=["user", "other"], name="compatibility_user_other_uniq")
+        ]
+
+class RelatedTag(models.Model):
+    """A tag often given to the same releases as another, stored for the top
+       few of each tag (see related_tags.py)"""
+    
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="related")
+    other = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="+")
+    #The cosine similarity of the releases of each
+    score = models.FloatField()
+    
+    class Meta:
+        ordering = ["-score"]
+        indexes = [models.Index(fields=["tag", "-score"])]
@@ -0,0 +1,133 @@
+"""Item-item recommendations: releases liked by the people who listened to a
+   given release. As in r8music v1, every listener of a release votes on each
+   other release they listened to, with their rating (through a sigmoid) or a
+   weaker vote if they didn't rate it. Releases are scored by the lower bound
+   of the confidence interval of their proportion of upvotes, so that a few
+   enthusiastic votes don't outrank many good ones.
+
+   The votes of all releases are computed at once, as sparse matrix products:
+   if A is the (users x releases) matrix of who listened to what, A.T @ L sums
+   the upvotes (L) and A.T @ W the total votes (W) for every pair of releases."""
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+from background_task import background
+
+from r8music.actions.models import ActiveActions
+from .models import ReleaseNeighbour
+
+#The number of neighbours stored for each release
+neighbour_no = 20
+
+#The z-score of a 95% confidence interval
+Z = 1.959963984540054
+
+def binomial_score(upvotes, total_votes):
+    """The lower bound of the Wilson score interval (vectorized)"""
+    p = upvotes / total_votes
+    return (
+        p + Z**2/(2*total_votes)
+        - Z*np.sqrt((p*(1 - p) + Z**2/(4*total_votes)) / total_votes)
+    ) / (1 + Z**2/total_votes)
+
+def sigmoid(rating):
+    #As in v1, but centred on the middle of the 1-8 scale rather than at 2
+    return 1/(1 + np.exp(-0.7*(rating - 4.5)))
+
+class Votes:
+    """The votes of each user on each release they listened to (or rated)"""
+
+    #The votes of a listen without a rating
+    unrated_upvote, unrated_vote = 0.4, 0.5
+
+    def __init__(self, actions):
+        """actions is a queryset of ActiveActions"""
+        rows = actions.exclude(listen=None, rate=None) \
+            .values_list("user_id", "release_id", "rating")
+
+        user_ids, release_ids, ratings = \
+            np.array(list(rows), dtype=float).reshape(-1, 3).T
+
+        self.user_ids, users = np.unique(user_ids.astype(int), return_inverse=True)
+        self.release_ids, releases = np.unique(release_ids.astype(int), return_inverse=True)
+
+        rated = ~np.isnan(ratings)
+        upvotes = np.where(rated, sigmoid(np.nan_to_num(ratings)), self.unrated_upvote)
+        votes = np.where(rated, 1.0, self.unrated_vote)
+
+        matrix = lambda values: sparse.csc_matrix(
+            (values, (users, releases)),
+            shape=(len(self.user_ids), len(self.release_ids))
+        )
+
+        self.listened = matrix(np.ones(len(users)))
+        self.upvotes = matrix(upvotes)
+        self.votes = matrix(votes)
+
+    def neighbours(self, columns):
+        """Yields (release id, [(neighbour id, score)]) for the releases in the
+           given columns, with the best neighbours first"""
+        listened = self.listened[:, columns].T.tocsr()
+
+        #The same sparsity pattern, so their data align once in canonical form
+        upvotes, votes = (listened @ self.upvotes).tocsr(), (listened @ self.votes).tocsr()
+        upvotes.sort_indices()
+        votes.sort_indices()
+
+        scores = binomial_score(upvotes.data, votes.data)
+
+        for row, column in enumerate(columns):
+            start, end = upvotes.indptr[row], upvotes.indptr[row + 1]
+            row_scores, row_releases = scores[start:end], upvotes.indices[start:end]
+
+            #A release isn't its own neighbour
+            others = row_releases != column
+            row_scores, row_releases = row_scores[others], row_releases[others]
+
+            best = np.argsort(-row_scores)[:neighbour_no]
+
+            yield self.release_ids[column], [
+                (self.release_ids[release], score)
+                for release, score in zip(row_releases[best], row_scores[best])
+            ]
+
+def store_neighbours(neighbours):
+    #Updates can overlap (a rating's update of one release, with the update of
+    #all of them or another of the same release), in which case the neighbours
+    #stored by the other are kept
+    ReleaseNeighbour.objects.bulk_create([
+        ReleaseNeighbour(release_id=release_id, neighbour_id=neighbour_id, score=score)
+        for release_id, release_neighbours in neighbours
+        for neighbour_id, score in release_neighbours
+    ], batch_size=10000, ignore_conflicts=True)
+
+def update_all_neighbours(chunk_size=1000):
+    """Recompute the neighbours of every release. The products are computed for
+       chunks of releases at a time to limit memory use."""
+    votes = Votes(ActiveActions.objects.all())
+
+    with transaction.atomic():
+        ReleaseNeighbour.objects.all().delete()
+
+        for start in range(0, len(votes.release_ids), chunk_size):
+            columns = np.arange(start, min(start + chunk_size, len(votes.release_ids)))
+            store_neighbours(votes.neighbours(columns))
+
+def update_neighbours(release_id):
+    """Recompute the neighbours of one release, from only the actions of its listeners"""
+    listeners = ActiveActions.objects.filter(release_id=release_id) \
+        .exclude(listen=None, rate=None).values("user_id")
+    votes = Votes(ActiveActions.objects.filter(user_id__in=listeners))
+
+    columns = np.flatnonzero(votes.release_ids == release_id)
+
+    with transaction.atomic():
+        ReleaseNeighbour.objects.filter(release_id=release_id).delete()
+        store_neighbours(votes.neighbours(columns))
+
+#Delayed, so that ratings in quick succession only cause one update
+@background(schedule=60, remove_existing_tasks=True)
+def schedule_update_neighbours(release_id):
+    update_neighbours(release_id)
@@ -0,0 +1,181 @@
+"""Personal recommendations ("for you"): releases a user hasn't listened to,
+   ranked by three signals, each computed for all users at once with sparse
+   matrix products:
+
+   - Their own taste. Every release they listened to votes for its neighbours
+     (see neighbours.py), for them if they liked it and against if not.
+   - The taste of the users they follow: the releases those users liked.
+   - Their favourite tags, as in UserProfile.favourite_tags: the tags of the
+     releases they listened to, weighed against how common each tag is.
+
+   The first two choose the candidates, which the tags then rerank, so that
+   only releases which somebody liked are recommended. The top few of each
+   user are stored, to be shown on the homepage."""
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+
+from django.contrib.auth.models import User
+from r8music.music.models import Release
+from r8music.actions.models import ActiveActions
+from r8music.profiles.models import Followership
+from .models import ReleaseNeighbour, UserRecommendation
+from .neighbours import Votes
+
+#The number of recommendations stored for each user
+recommendation_no = 24
+
+#The weight of each signal, relative to the user's own taste
+follows_weight = 0.5
+tags_weight = 0.3
+
+def normalize_rows(matrix):
+    """Scale each row of a sparse matrix so that its greatest magnitude is 1"""
+    if not matrix.shape[1]:
+        return matrix.tocsr()
+        
+    greatest = abs(matrix).max(axis=1).toarray().ravel()
+    greatest[greatest == 0] = 1
+    return (sparse.diags(1 / greatest) @ matrix).tocsr()
+
+class Recommender:
+    def __init__(self):
+        votes = Votes(ActiveActions.objects.all())
+        self.user_ids = np.array(User.objects.order_by("id").values_list("id", flat=True), dtype=int)
+        self.release_ids = votes.release_ids
+
+        #Votes only has the users with actions, so move its rows into place
+        voters = self.matrix(
+            np.searchsorted(self.user_ids, votes.user_ids), np.arange(len(votes.user_ids)),
+            np.ones(len(votes.user_ids)), shape=(len(self.user_ids), len(votes.user_ids))
+        )
+
+        self.listened = (voters @ votes.listened).tocsr()
+        #From -0.5 (hated) to 0.5 (loved), with listens without a rating mildly positive
+        self.taste = (voters @ (votes.upvotes - votes.votes/2)).tocsr()
+
+        self.similarity = self.neighbour_matrix()
+        self.follows = self.follow_matrix()
+        self.favourite_tags, self.release_tags = self.tag_matrices()
+
+    def matrix(self, rows, columns, values, shape):
+        return sparse.csr_matrix((values, (rows, columns)), shape=shape)
+
+    def releases(self, release_ids):
+        """The columns of the given releases, and which of them have columns
+           (those with no listens don't)"""
+        if not len(self.release_ids):
+            return np.zeros(len(release_ids), dtype=int), np.zeros(len(release_ids), dtype=bool)
+
+        columns = np.searchsorted(self.release_ids, release_ids).clip(max=len(self.release_ids) - 1)
+        return columns, self.release_ids[columns] == release_ids
+
+    def neighbour_matrix(self):
+        release_ids, neighbour_ids, scores = np.array(
+            list(ReleaseNeighbour.objects.values_list("release_id", "neighbour_id", "score")),
+            dtype=float
+        ).reshape(-1, 3).T
+
+        (releases, found), (neighbours, neighbour_found) = \
+            self.releases(release_ids.astype(int)), self.releases(neighbour_ids.astype(int))
+        found &= neighbour_found
+
+        return self.matrix(
+            releases[found], neighbours[found], scores[found],
+            shape=(len(self.release_ids),)*2
+        )
+
+    def follow_matrix(self):
+        """The users each user follows, weighted so that each row sums to one"""
+        follower_ids, user_ids = np.array(
+            list(Followership.objects.values_list("follower_id", "user_id")), dtype=int
+        ).reshape(-1, 2).T
+
+        follows = self.matrix(
+            np.searchsorted(self.user_ids, follower_ids), np.searchsorted(self.user_ids, user_ids),
+            np.ones(len(user_ids)), shape=(len(self.user_ids),)*2
+        )
+
+        follow_no = np.asarray(follows.sum(axis=1)).ravel()
+        follow_no[follow_no == 0] = 1
+        return (sparse.diags(1 / follow_no) @ follows).tocsr()
+
+    def tag_matrices(self):
+        """The favourite tags of each user (with the greatest weighing 1), and
+           the tags of each release (each weighing 1/the number of tags)"""
+        release_ids, tag_ids = np.array(
+            list(Release.tags.through.objects.values_list("release_id", "tag_id")), dtype=int
+        ).reshape(-1, 2).T
+
+        tag_ids, tags = np.unique(tag_ids, return_inverse=True)
+        #Of all releases, not just those listened to
+        frequencies = np.bincount(tags, minlength=len(tag_ids))
+
+        releases, found = self.releases(release_ids)
+        release_tags = self.matrix(
+            releases[found], tags[found], np.ones(found.sum()),
+            shape=(len(self.release_ids), len(tag_ids))
+        )
+
+        favourite_tags = normalize_rows(
+            self.listened @ release_tags @ sparse.diags(1 / np.sqrt(frequencies))
+        )
+
+        tag_no = np.asarray(release_tags.sum(axis=1)).ravel()
+        tag_no[tag_no == 0] = 1
+
+        return favourite_tags, (sparse.diags(1 / tag_no) @ release_tags).tocsr()
+
+    def recommendations(self, rows):
+        """Yields (user id, release id, score) for the best releases of the
+           users in the given rows"""
+        taste = normalize_rows(self.taste[rows] @ self.similarity)
+        follows_taste = normalize_rows(self.follows[rows] @ self.taste)
+        scores = (taste + follows_weight*follows_taste).tocsr()
+
+        #Only recommend releases that the user hasn't listened to, and is likely to like
+        scores = scores.multiply(scores > 0).tocsr()
+        scores = (scores - scores.multiply(self.listened[rows])).tocoo()
+        scores.eliminate_zeros()
+
+        #The affinity of each candidate with the user's favourite tags: the
+        #mean weight of its tags, summed over the tags of each candidate
+        favourite_tags = self.favourite_tags[rows].toarray()
+        release_tags = self.release_tags[scores.col]
+        candidates = np.repeat(np.arange(scores.nnz), np.diff(release_tags.indptr))
+
+        affinity = np.bincount(
+            candidates,
+            weights=release_tags.data * favourite_tags[scores.row[candidates], release_tags.indices],
+            minlength=scores.nnz
+        )
+
+        total = scores.data + tags_weight*affinity
+
+        #Sorted by user and then score, so each user's best are at the start of their run
+        order = np.lexsort((-total, scores.row))
+        users = scores.row[order]
+        rank = np.arange(len(order)) - np.searchsorted(users, users)
+        best = order[rank < recommendation_no]
+
+        for row, column, score in zip(scores.row[best], scores.col[best], total[best]):
+            yield self.user_ids[rows][row], self.release_ids[column], score
+
+def update_all_recommendations(chunk_size=1000):
+    """Recompute the recommendations of every user, for chunks of users at a
+       time to limit memory use. Too slow to run after each action, so run
+       periodically."""
+    recommender = Recommender()
+
+    with transaction.atomic():
+        UserRecommendation.objects.all().delete()
+
+        for start in range(0, len(recommender.user_ids), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(recommender.user_ids)))
+
+            UserRecommendation.objects.bulk_create([
+                UserRecommendation(user_id=user_id, release_id=release_id, score=score)
+                for user_id, release_id, score in recommender.recommendations(rows)
+            ], batch_size=10000)
@@ -0,0 +1,55 @@
+"""Related tags: those given to many of the same releases. If T is the
+   (releases x tags) matrix of which releases have which tags, T.T @ T counts
+   the releases shared by each pair of tags. These are scored by their cosine
+   similarity (the count over the geometric mean of the numbers of releases
+   of each), so that very common tags aren't related to everything."""
+
+import numpy as np
+from scipy import sparse
+
+from django.db import transaction
+
+from r8music.music.models import Release
+from .models import RelatedTag
+
+#The number of related tags stored for each tag
+related_tag_no = 8
+
+def related_tags():
+    """Yields (tag id, [(related tag id, score)]), the most related first"""
+    release_ids, tag_ids = np.array(
+        list(Release.tags.through.objects.values_list("release_id", "tag_id")), dtype=int
+    ).reshape(-1, 2).T
+
+    _, releases = np.unique(release_ids, return_inverse=True)
+    tag_ids, tags = np.unique(tag_ids, return_inverse=True)
+
+    taggings = sparse.csc_matrix(
+        (np.ones(len(tags)), (releases, tags)),
+        shape=(releases.max(initial=-1) + 1, len(tag_ids))
+    )
+
+    shared = (taggings.T @ taggings).tocsr()
+    sizes = shared.diagonal()
+
+    for tag in range(len(tag_ids)):
+        start, end = shared.indptr[tag], shared.indptr[tag + 1]
+        others, counts = shared.indices[start:end], shared.data[start:end]
+
+        scores = counts / np.sqrt(sizes[tag] * sizes[others])
+        scores[others == tag] = 0
+
+        best = np.argsort(-scores)[:related_tag_no]
+        best = best[scores[best] > 0]
+
+        yield tag_ids[tag], [(tag_ids[other], score) for other, score in zip(others[best], scores[best])]
+
+def update_related_tags():
+    with transaction.atomic():
+        RelatedTag.objects.all().delete()
+
+        RelatedTag.objects.bulk_create([
+            RelatedTag(tag_id=tag_id, other_id=other_id, score=score)
+            for tag_id, related in related_tags()
+            for other_id, score in related
+        ], batch_size=10000)
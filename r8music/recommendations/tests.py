@@ -0,0 +1,180 @@
+import numpy as np
+
+from django.test import TestCase
+from django.core.cache import cache
+
+from django.contrib.auth.models import User
+from r8music.music.models import Release, Tag
+from r8music.actions.models import ListenAction, RateAction, enact
+from r8music.profiles.models import Followership
+from r8music.v1.tools import binomial_score as v1_binomial_score
+from .models import ReleaseNeighbour, Compatibility
+from .neighbours import binomial_score, store_neighbours, update_all_neighbours, update_neighbours
+from .personal import update_all_recommendations
+from .compatibility import (
+    Tastes, get_compatibility, update_all_compatibilities, store_compatibilities, shrinkage
+)
+from .related_tags import update_related_tags
+
+class RecommendationsTestCase(TestCase):
+    def setUp(self):
+        self.releases = [
+            Release.objects.create(title=title, slug=title.lower())
+            for title in ["Kid A", "Amnesiac", "Ten"]
+        ]
+        kid_a, amnesiac, ten = self.releases
+        
+        #Everyone who listened to Kid A loved Amnesiac, but not Ten
+        for n in range(10):
+            user = User.objects.create_user("user%d" % n)
+            
+            enact(ListenAction.objects.create(user=user, release=kid_a))
+            enact(RateAction.objects.create(user=user, release=amnesiac, rating=8))
+            enact(RateAction.objects.create(user=user, release=ten, rating=2))
+        
+class NeighboursTest(RecommendationsTestCase):
+    def neighbours(self, release):
+        return list(release.neighbours.values_list("neighbour__title", flat=True))
+        
+    def test_binomial_score(self):
+        #(v1 approximated the z-score)
+        self.assertAlmostEqual(binomial_score(7.5, 10), v1_binomial_score(7.5, 10), places=3)
+        
+    def test_neighbours(self):
+        update_all_neighbours()
+        kid_a, amnesiac, ten = self.releases
+        
+        self.assertEqual(self.neighbours(kid_a), ["Amnesiac", "Ten"])
+        self.assertEqual(self.neighbours(ten), ["Amnesiac", "Kid A"])
+        
+    def test_update_one_release(self):
+        update_all_neighbours()
+        all_at_once = list(ReleaseNeighbour.objects.values_list("release", "neighbour", "score"))
+        
+        for release in self.releases:
+            update_neighbours(release.id)
+        
+        for (release, neighbour, score), expected in zip(
+            ReleaseNeighbour.objects.values_list("release", "neighbour", "score"), all_at_once
+        ):
+            self.assertEqual((release, neighbour), expected[:2])
+            self.assertAlmostEqual(score, expected[2])
+            
+    def test_overlapping_updates(self):
+        kid_a, amnesiac, ten = self.releases
+        update_all_neighbours()
+        
+        #As if another update stored the same neighbours at the same time
+        store_neighbours([(kid_a.id, [(amnesiac.id, 1.0)])])
+        
+        self.assertEqual(self.neighbours(kid_a), ["Amnesiac", "Ten"])
+
+class PersonalRecommendationsTest(RecommendationsTestCase):
+    def recommendations(self, user):
+        update_all_neighbours()
+        update_all_recommendations()
+        return list(user.recommendations.values_list("release__title", flat=True))
+        
+    def test_own_ratings(self):
+        kid_a, amnesiac, ten = self.releases
+        user = User.objects.create_user("radiohead_fan")
+        enact(RateAction.objects.create(user=user, release=kid_a, rating=7))
+        
+        #Ten is a neighbour of Kid A too, but a worse one
+        self.assertEqual(self.recommendations(user), ["Amnesiac", "Ten"])
+        
+    def test_follows(self):
+        user = User.objects.create_user("friend")
+        Followership.objects.create(user=User.objects.get(username="user0"), follower=user)
+        
+        #Not Ten, which user0 disliked
+        self.assertEqual(self.recommendations(user), ["Amnesiac", "Kid A"])
+        
+    def test_not_listened(self):
+        user = User.objects.get(username="user0")
+        self.assertEqual(self.recommendations(user), [])
+
+class CompatibilityTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        
+        releases = [
+            Release.objects.create(title="Release %d" % n, slug="release-%d" % n)
+            for n in range(6)
+        ]
+        
+        self.users = [User.objects.create_user(name) for name in ["a", "b", "c"]]
+        
+        for user, ratings in zip(self.users, [
+            [1, 3, 4, 6, 8, None],
+            [2, 3, 5, 5, 7, 8],
+            [8, None, 5, 3, 1, 2]
+        ]):
+            for release, rating in zip(releases, ratings):
+                if rating:
+                    enact(RateAction.objects.create(user=user, release=release, rating=rating))
+                    
+    def test_correlation(self):
+        a, b, c = self.users
+        score = Tastes([a.id, b.id]).compatibility([(a.id, b.id)])[0]
+        
+        #Over the five releases rated by both, with no tags
+        correlation = np.corrcoef([1, 3, 4, 6, 8], [2, 3, 5, 5, 7])[0, 1] * 5/(5 + shrinkage)
+        self.assertAlmostEqual(score, 0.7*(correlation + 1)/2)
+        
+        self.assertLess(get_compatibility(a, c), get_compatibility(a, b))
+        
+    def test_stored_and_cached(self):
+        a, b, c = self.users
+        on_demand = get_compatibility(a, b)
+        
+        Followership.objects.create(user=a, follower=b)
+        update_all_compatibilities()
+        
+        with self.assertNumQueries(1):
+            self.assertAlmostEqual(get_compatibility(b, a), on_demand)
+            
+        #Cached, until c rates something
+        before = get_compatibility(a, c)
+        
+        with self.assertNumQueries(1):
+            get_compatibility(a, c)
+            
+        enact(RateAction.objects.create(user=c, release=Release.objects.get(slug="release-1"), rating=1))
+        self.assertNotAlmostEqual(get_compatibility(a, c), before)
+        
+        #The version is stored in the database, so other processes see it too
+        self.assertEqual(c.profile.ratings_version, 6)
+        
+    def test_overlapping_updates(self):
+        a, b, c = self.users
+        Followership.objects.create(user=a, follower=b)
+        update_all_compatibilities()
+        
+        #As if another update stored the same pairs at the same time
+        store_compatibilities(Tastes([a.id, b.id]), [(a.id, b.id)])
+        
+        self.assertEqual(Compatibility.objects.filter(user=a, other=b).count(), 1)
+        self.assertAlmostEqual(get_compatibility(a, b), get_compatibility(b, a))
+        
+class RelatedTagsTest(TestCase):
+    def test(self):
+        rock, indie, jazz, pop = [
+            Tag.objects.create(name=name, title=name.title(), description="")
+            for name in ["rock", "indie", "jazz", "pop"]
+        ]
+        
+        for n, tags in enumerate([
+            [rock, indie], [rock, indie], [rock, indie, pop], [rock, pop], [jazz]
+        ]):
+            Release.objects.create(title="Release %d" % n, slug="release-%d" % n).tags.set(tags)
+            
+        update_related_tags()
+        related = lambda tag: list(tag.related.values_list("other__name", flat=True))
+        
+        #Indie shares three of its three releases with rock, pop only two of its four
+        self.assertEqual(related(rock), ["indie", "pop"])
+        self.assertEqual(related(indie), ["rock", "pop"])
+        self.assertEqual(related(jazz), [])
+        
+        self.assertAlmostEqual(rock.related.first().score, 3/np.sqrt(4*3))
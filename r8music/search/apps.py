@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models import CharField, TextField
 
 
 class SearchConfig(AppConfig):
     name = 'r8music.search'
+    
+    def ready(self):
+        from .trigram import TrigramWordSimilar
+        
+        CharField.register_lookup(TrigramWordSimilar)
+        TextField.register_lookup(TrigramWordSimilar)
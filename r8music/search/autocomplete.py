@@ -0,0 +1,284 @@
+"""An in-memory index of artist names and release titles, for autocompletion.
+
+   Each process keeps its own copy, built on first use (or at startup, see
+   wsgi.py). The importer runs in a separate process, so rather than being
+   notified, the index polls for newly imported artists and releases at most
+   once every `refresh_interval` seconds. Only those with search vectors are
+   loaded, as the importer stores those last, once a release has its artists.
+
+   Reimported artists and releases replace the originals with new rows, which
+   keep the same slug, so items are deduplicated by slug. Items deleted without
+   replacement are left in the index until the process restarts."""
+
+import re
+from hashlib import md5
+from bisect import bisect_left
+from collections import namedtuple, defaultdict
+from threading import Lock
+from time import monotonic
+from unidecode import unidecode
+
+from django.core.cache import cache
+
+from r8music.music.models import Artist, Release
+
+word_pattern = re.compile("[a-z0-9]+")
+
+def normalize(name):
+    """Lowercase ASCII words separated by single spaces, so that neither case,
+       accents nor punctuation affect matching"""
+    return " ".join(word_pattern.findall(unidecode(name).lower()))
+
+def word_suffixes(key):
+    """Each point a word can be matched from, excluding the start (the whole key):
+       "the golden heart" -> "golden heart", "heart" """
+    return [key[match.start():] for match in re.finditer(" ", key)]
+
+class PrefixIndex:
+    """A sorted array of (key, id), searched by binary search for keys with a
+       given prefix"""
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, entries):
+        #Timsort is linear when merging a sorted array with a small batch
+        self.entries = sorted(self.entries + list(entries))
+
+    def search(self, prefix):
+        """Ids with a key starting with the prefix, in order of their keys
+           (so shorter, closer matches come first). A generator, so only as
+           many matches as are used are read."""
+        entries = self.entries
+
+        for i in range(bisect_left(entries, (prefix,)), len(entries)):
+            key, id = entries[i]
+
+            if not key.startswith(prefix):
+                break
+
+            yield id
+
+#An artist or release as shown in the menu (the slug is used to form the URL),
+#with the keys it can be found by
+Item = namedtuple("Item", ["name", "slug", "keys"])
+
+def item_matches(item, query):
+    return any(key.startswith(query) for key in item.keys)
+
+class Matches(namedtuple("Matches", ["artists", "releases", "complete"])):
+    """The artists and releases matching a query, in order of preference. If
+       complete, these are all the matches rather than just the first few, so
+       the matches of a longer query are among them."""
+
+    def filter(self, query):
+        """The matches of a longer query (only if complete)"""
+        return Matches(
+            [artist for artist in self.artists if item_matches(artist, query)],
+            [release for release in self.releases if item_matches(release, query)],
+            complete=True
+        )
+
+class AutocompleteIndex:
+    refresh_interval = 10
+    #The maximum number of results, and of those, the number of artists which
+    #are shown if there are also enough releases
+    limit = 15
+    artist_limit = 5
+
+    def __init__(self):
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.artists, self.releases = {}, {}
+            self.last_artist_id = self.last_release_id = 0
+            self.last_refresh = None
+
+            #Artists by name and releases by title, from the start...
+            self.artist_names, self.release_titles = PrefixIndex(), PrefixIndex()
+            #...or from a later word
+            self.artist_words, self.release_words = PrefixIndex(), PrefixIndex()
+            #Releases by the names of their artists
+            self.release_artists = PrefixIndex()
+
+    def add_artists(self, artists):
+        keys = []
+
+        for id, name, slug in artists:
+            key = normalize(name)
+            self.artists[id] = Item(name, slug, [key] + word_suffixes(key))
+            keys.append((key, id))
+
+        self.artist_names.add(keys)
+        self.artist_words.add((suffix, id) for key, id in keys for suffix in word_suffixes(key))
+
+    def add_releases(self, releases, artist_names):
+        keys = []
+
+        for id, title, slug in releases:
+            key = normalize(title)
+            self.releases[id] = Item(
+                title + " by " + " & ".join(artist_names[id]), slug,
+                [key] + word_suffixes(key) + [normalize(name) for name in artist_names[id]]
+            )
+            keys.append((key, id))
+
+        self.release_titles.add(keys)
+        self.release_words.add((suffix, id) for key, id in keys for suffix in word_suffixes(key))
+        self.release_artists.add(
+            (normalize(name), id) for _key, id in keys for name in artist_names[id]
+        )
+
+    def load(self):
+        """Add artists and releases created since the last load. Returns
+           whether there were any."""
+        artists = list(
+            Artist.objects.filter(id__gt=self.last_artist_id, search_vector__isnull=False)
+                .order_by("id").values_list("id", "name", "slug")
+        )
+        releases = list(
+            Release.objects.filter(id__gt=self.last_release_id, search_vector__isnull=False)
+                .order_by("id").values_list("id", "title", "slug")
+        )
+
+        artist_names = defaultdict(list)
+
+        for release_id, name in Release.artists.through.objects \
+            .filter(release_id__gt=self.last_release_id, release__search_vector__isnull=False) \
+            .order_by("id").values_list("release_id", "artist__name"):
+            artist_names[release_id].append(name)
+
+        if artists:
+            self.add_artists(artists)
+            self.last_artist_id = artists[-1][0]
+
+        if releases:
+            self.add_releases(releases, artist_names)
+            self.last_release_id = releases[-1][0]
+
+        return bool(artists or releases)
+
+    def refresh(self):
+        with self.lock:
+            if self.last_refresh is None or monotonic() - self.last_refresh > self.refresh_interval:
+                #Cached results may be missing the new items
+                if self.load():
+                    autocomplete_cache.invalidate()
+
+                self.last_refresh = monotonic()
+
+    def matches(self, indices, items, query, limit):
+        """Search the indices in order of preference, without repeating items"""
+        matches = {}
+
+        for index in indices:
+            for id in index.search(query):
+                if len(matches) == limit:
+                    return list(matches.values())
+
+                #Replacements have greater ids, so are found later
+                item = items[id]
+                matches[item.slug] = item
+
+        return list(matches.values())
+
+    def find(self, query):
+        """Query should already be normalized"""
+        self.refresh()
+
+        if not query:
+            return Matches([], [], complete=True)
+
+        artists = self.matches([self.artist_names, self.artist_words], self.artists, query, self.limit)
+        releases = self.matches(
+            [self.release_titles, self.release_words, self.release_artists],
+            self.releases, query, self.limit
+        )
+
+        return Matches(artists, releases, complete=len(artists) < self.limit and len(releases) < self.limit)
+
+    def select(self, matches):
+        """The artists and releases to show in the menu, from the matches"""
+        artists, releases = matches.artists, matches.releases
+
+        #Show fewer artists when there are enough releases to fill the menu
+        artist_no = min(len(artists), max(self.artist_limit, self.limit - len(releases)))
+        return artists[:artist_no], releases[:self.limit - artist_no]
+
+autocomplete_index = AutocompleteIndex()
+
+#The artists and releases shown for a query, as cached
+Result = namedtuple("Result", ["artists", "releases", "matches"])
+
+class AutocompleteCache:
+    """Caches the matches of each normalized query (in the Django cache, so
+       shared between processes if the cache backend is). A query can also be
+       answered by filtering the complete matches of one of its prefixes,
+       which is likely to be cached as it will have just been typed.
+
+       Invalidated by changing the version included in each key, when new
+       artists or releases are found."""
+
+    timeout = 60
+    version_key = "autocomplete:version"
+
+    def __init__(self, index):
+        self.index = index
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key)
+
+        except ValueError:
+            cache.set(self.version_key, 1, None)
+
+    def key(self, version, query):
+        #Hashed, as some cache backends only allow certain characters
+        return "autocomplete:%d:%s" % (version, md5(query.encode()).hexdigest())
+
+    def search(self, query, fallback=None):
+        """Returns a Result. The fallback, called when nothing matches, may
+           search another way, returning incomplete Matches."""
+        self.index.refresh()
+
+        query = normalize(query)
+        version = cache.get_or_set(self.version_key, 0, None)
+
+        #Keys of the query and its prefixes, longest first
+        keys = {
+            length: self.key(version, query[:length])
+            for length in range(len(query), 0, -1)
+        }
+
+        cached = cache.get_many(keys.values())
+
+        if keys.get(len(query)) in cached:
+            return cached[keys[len(query)]]
+
+        prefix_matches = (
+            cached[key].matches for key in keys.values()
+            if key in cached and cached[key].matches.complete
+        )
+
+        prefix_matches = next(prefix_matches, None)
+
+        if prefix_matches:
+            matches = prefix_matches.filter(query)
+
+        else:
+            matches = self.index.find(query)
+
+        if fallback and not matches.artists and not matches.releases:
+            matches = fallback()
+
+        artists, releases = self.index.select(matches)
+        result = Result(artists, releases, matches)
+
+        if query:
+            cache.set(keys[len(query)], result, self.timeout)
+
+        return result
+
+autocomplete_cache = AutocompleteCache(autocomplete_index)
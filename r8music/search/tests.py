@@ -0,0 +1,115 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from django.contrib.auth.models import User
+
+from r8music.testing import QueryBudgetTestCase
+from r8music.music.models import Artist, Release, update_search_vectors
+from .autocomplete import autocomplete_index, autocomplete_cache
+
+class SearchTest(TestCase):
+    def setUp(self):
+        artist = Artist.objects.create(name="Björk", slug="bjork")
+        release = Release.objects.create(title="Homogenic", slug="homogenic")
+        release.artists.add(artist)
+        Artist.objects.create(name="Radiohead", slug="radiohead")
+        update_search_vectors()
+        autocomplete_index.clear()
+        
+    def search(self, query):
+        response = self.client.get(reverse("search_api"), {"q": query})
+        return [result["name"] for result in response.json()["results"]]
+        
+    def test_transliteration(self):
+        self.assertIn("Björk", self.search("bjork"))
+        
+    def test_prefix(self):
+        self.assertEqual(self.search("homog"), ["Homogenic by Björk"])
+        
+    def test_typo(self):
+        self.assertEqual(self.search("radiohed"), ["Radiohead"])
+        
+    def test_artist_names_of_releases(self):
+        #The artist is listed before their release
+        self.assertEqual(self.search("björk"), ["Björk", "Homogenic by Björk"])
+        
+    def test_prefix_reuse(self):
+        with mock.patch.object(autocomplete_index, "find", wraps=autocomplete_index.find) as find:
+            self.assertEqual(self.search("ho"), ["Homogenic by Björk"])
+            #Answered by filtering the (complete) matches of "ho"
+            self.assertEqual(self.search("hom"), ["Homogenic by Björk"])
+            self.assertEqual(self.search("hoc"), [])
+            
+        self.assertEqual(find.call_count, 1)
+        
+    def test_invalidation(self):
+        self.assertEqual(self.search("pablo"), [])
+        
+        Artist.objects.create(name="Pablo Honey", slug="pablo-honey")
+        update_search_vectors()
+        autocomplete_cache.invalidate()
+        #The index itself only checks for new artists every few seconds
+        autocomplete_index.last_refresh = None
+        
+        self.assertEqual(self.search("pablo"), ["Pablo Honey"])
+        
+    def test_users(self):
+        user = User.objects.create_user("bjorkfan")
+        self.assertEqual(self.search("bjorkf"), ["bjorkfan"])
+        
+        #With a typo
+        response = self.client.get(reverse("user_search"), {"q": "bjorkfam"})
+        self.assertEqual(list(response.context_data["results"]), [user])
+        
+    def test_no_query(self):
+        for view_name in ["artist_search", "release_search", "user_search"]:
+            response = self.client.get(reverse(view_name))
+            self.assertEqual(response.status_code, 200, view_name)
+            self.assertEqual(list(response.context_data["results"]), [])
+            
+    def test_facets(self):
+        release = Release.objects.get(slug="homogenic")
+        release.release_date = "1997-09-22"
+        release.tags.create(name="Electronic")
+        release.save()
+        
+        Release.objects.create(title="Homogenic Remixes", slug="homogenic-remixes") \
+            .tags.create(name="Remix")
+        update_search_vectors()
+        
+        response = self.client.get(reverse("release_search"), {"q": "homogenic"})
+        facets = response.context_data["facets"]
+        
+        self.assertEqual(len(response.context_data["results"]), 2)
+        self.assertEqual({name: count for _id, name, count in facets["tag"]}, {"Electronic": 1, "Remix": 1})
+        self.assertEqual(facets["year"], [(1997, "1997", 1)])
+        
+        response = self.client.get(reverse("release_search"), {"q": "homogenic", "year": 1997})
+        self.assertEqual(list(response.context_data["results"]), [release])
+        
+    def test_etag(self):
+        response = self.client.get(reverse("search_api"), {"q": "homog"})
+        
+        response = self.client.get(
+            reverse("search_api"), {"q": "homog"}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+class QueryBudgetTest(QueryBudgetTestCase):
+    def test_search(self):
+        for route, max_queries in [
+            ("search", 4),
+            ("artist_search", 2),
+            ("release_search", 6),
+            ("user_search", 2)
+        ]:
+            #A short prefix, matching many artists and releases
+            self.assertWithinBudget(reverse(route) + "?q=si", max_queries)
+            
+    def test_search_api(self):
+        autocomplete_index.clear()
+        autocomplete_index.refresh()
+        #Served from memory, except for users
+        self.assertWithinBudget(reverse("search_api") + "?q=si", 1)
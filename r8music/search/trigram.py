@@ -0,0 +1,25 @@
+"""Trigram word similarity, which Django (before 4.0) doesn't provide. Requires
+   the pg_trgm extension, created by the music app before migrating."""
+
+from django.db.models import Func, Value, FloatField
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+
+class TrigramWordSimilarity(Func):
+    """The greatest similarity between the string and any substring of whole
+       words in the expression, so that a short query can match a long name."""
+    
+    function = "WORD_SIMILARITY"
+    
+    def __init__(self, string, expression, **extra):
+        if not hasattr(string, "resolve_expression"):
+            string = Value(string)
+            
+        super().__init__(string, expression, output_field=FloatField(), **extra)
+
+class TrigramWordSimilar(PostgresOperatorLookup):
+    """field__trigram_word_similar=string, true when the word similarity is above
+       pg_trgm.word_similarity_threshold. Unlike comparing TrigramWordSimilarity,
+       this can use a trigram index on the field."""
+    
+    lookup_name = "trigram_word_similar"
+    postgres_operator = "%%>"
@@ -1,10 +1,11 @@
 from django.urls import path
 
-from .views import GeneralSearchPage, ArtistSearchPage, ReleaseSearchPage, SearchAPI
+from .views import GeneralSearchPage, ArtistSearchPage, ReleaseSearchPage, UserSearchPage, SearchAPI
 
 urlpatterns = [
     path("search", GeneralSearchPage.as_view(), name="search"),
     path("search/artists", ArtistSearchPage.as_view(), name="artist_search"),
     path("search/releases", ReleaseSearchPage.as_view(), name="release_search"),
+    path("search/users", UserSearchPage.as_view(), name="user_search"),
     path("api/search", SearchAPI.as_view(), name="search_api"),
 ]
@@ -1,4 +1,5 @@
 from editdistance import eval as edit_distance
+from hashlib import md5
 from urllib.parse import urlencode
 
 from django.views.generic import View, ListView
@@ -8,16 +9,22 @@ from django.shortcuts import render, redirect
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from django.db.models import Value, IntegerField
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import Value, IntegerField, FloatField, F, Q, Case, When, Count
+from django.db.models.functions import Substr
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
 
-from r8music.music.models import Release, Artist
+from django.contrib.auth.models import User
+from r8music.music.models import Release, Artist, Tag, ReleaseType
+from r8music.music.cards import load_release_cards
+from r8music.actions.overlay import viewer_overlay
 from r8music.music.urls import url_for_artist, url_for_release
+from r8music.profiles.urls import url_for_user
+from .trigram import TrigramWordSimilarity
+from .autocomplete import autocomplete_cache, Item, Matches
 
 class AbstractSearchPage:
-    #The minimum search rank to be included
-    #Some irrelevant results still get above zero (e.g. 1e-20).
-    rank_threshold = 0.001
+    #Shorter queries have too few trigrams to be compared reliably
+    fuzzy_min_length = 4
     
     def get_query_str(self):
         return self.request.GET.get("q")
@@ -26,21 +33,56 @@ class AbstractSearchPage:
         query_param = self.request.GET.get("q")
         return reverse(view_name) + "?" + urlencode({"q": query_param})
         
-    def search(self, model, search_vector, order):
-        query_str = self.get_query_str()
+    def search(self, model, name_field, order):
+        query_str = self.get_query_str() or ""
+        
+        if not query_str:
+            return model.objects.none()
+            
         #:* allows prefix matches, quotes escape the query from the search syntax
         query = SearchQuery("'%s':*" % query_str, search_type="raw")
         
+        #Matching against the stored search vector uses its index, so only
+        #the matching rows are ranked
+        matches = Q(search_vector=query)
+        rank = SearchRank(F("search_vector"), query)
+        
+        #Fuzzy matching of the name, for typos (also using an index)
+        if len(query_str) >= self.fuzzy_min_length:
+            matches |= Q(**{name_field + "__trigram_word_similar": query_str})
+            rank = rank \
+                + TrigramWordSimilarity(query_str, name_field) \
+                + TrigramSimilarity(name_field, query_str)
+        
         return model.objects \
-            .annotate(rank=SearchRank(search_vector, query)) \
-            .filter(rank__gte=self.rank_threshold) \
+            .filter(matches) \
+            .annotate(rank=rank) \
             .order_by("-rank", order)
         
     def search_artists(self):
-        return self.search(Artist, SearchVector("name"), order="name")
+        return self.search(Artist, "name", order="name")
         
     def search_releases(self):
-        return self.search(Release, SearchVector("title"), order="release_date")
+        #Releases also match the names of their artists, though ranked lower
+        return self.search(Release, "title", order="release_date")
+        
+    def search_users(self):
+        query_str = self.get_query_str() or ""
+        
+        if not query_str:
+            return User.objects.none()
+            
+        #Usernames are single words, so rather than full text search, match
+        #prefixes and similar usernames (both indexed, see profiles.apps)
+        is_prefix = Q(username__istartswith=query_str)
+        matches = is_prefix
+        rank = Case(When(is_prefix, then=Value(1.0)), default=Value(0.0), output_field=FloatField())
+        
+        if len(query_str) >= self.fuzzy_min_length:
+            matches |= Q(username__trigram_similar=query_str)
+            rank = rank + TrigramSimilarity("username", query_str)
+        
+        return User.objects.filter(matches).annotate(rank=rank).order_by("-rank", "username")
 
 class GeneralSearchPage(View, AbstractSearchPage):
     def get_results_page(self):
@@ -57,8 +99,10 @@ class GeneralSearchPage(View, AbstractSearchPage):
             "query": self.get_query_str(),
             "artists": artist_results,
             "releases": self.search_releases().prefetch_related("artists")[:10],
+            "users": self.search_users()[:10],
             "url_for_artist_search": self.get_search_url("artist_search"),
-            "url_for_release_search": self.get_search_url("release_search")
+            "url_for_release_search": self.get_search_url("release_search"),
+            "url_for_user_search": self.get_search_url("user_search")
         })
         
     def get(self, request):
@@ -71,10 +115,11 @@ class GeneralSearchPage(View, AbstractSearchPage):
 class AbstractCategorySearchPage(ListView, AbstractSearchPage):
     context_object_name = "results"
     
-    def get_context_data(self):
+    def get_context_data(self, **kwargs):
         return super().get_context_data(
             query=self.get_query_str(),
-            url_for_general_search=self.get_search_url("search")
+            url_for_general_search=self.get_search_url("search"),
+            **kwargs
         )
         
 class ArtistSearchPage(AbstractCategorySearchPage):
@@ -87,14 +132,78 @@ class ArtistSearchPage(AbstractCategorySearchPage):
 class ReleaseSearchPage(AbstractCategorySearchPage):
     template_name = "search/release_results.html"
     paginate_by = 18
+    #The number of tags listed (by how many of the results have them)
+    tag_facet_limit = 20
     
+    def get_facet_filters(self):
+        """The facet values selected, by URL parameters (tag, year and type)"""
+        get_int = lambda name: int(self.request.GET[name]) \
+            if self.request.GET.get(name, "").isdigit() else None
+        
+        return {"tag": get_int("tag"), "year": get_int("year"), "type": get_int("type")}
+        
     def get_queryset(self):
-        return self.search_releases().prefetch_related("artists")
+        filters = self.get_facet_filters()
+        releases = self.search_releases()
+        
+        if filters["tag"] is not None:
+            releases = releases.filter(tags=filters["tag"])
+            
+        if filters["year"] is not None:
+            releases = releases.filter(release_date__startswith="%04d" % filters["year"])
+            
+        if filters["type"] is not None:
+            releases = releases.filter(type=filters["type"])
+        
+        return releases
+        
+    def get_facets(self, releases):
+        """Counts of the releases with each tag, year and type, with one
+           grouped query for each"""
+        releases = Release.objects.filter(id__in=releases.values("id")).order_by()
+        
+        tags = Tag.objects.filter(releases__in=releases) \
+            .annotate(count=Count("releases")) \
+            .order_by("-count", "name")[:self.tag_facet_limit]
+        
+        years = releases.exclude(release_date=None) \
+            .annotate(year=Substr("release_date", 1, 4)) \
+            .values_list("year").annotate(count=Count("id")).order_by("-year")
+        
+        types = releases.exclude(type=None) \
+            .values_list("type").annotate(count=Count("id")).order_by("-count")
+        
+        return {
+            "tag": [(tag.id, tag.name, tag.count) for tag in tags],
+            "year": [(int(year), year, count) for year, count in years if year.isdigit()],
+            "type": [(type, ReleaseType.get(type).label, count) for type, count in types]
+        }
+        
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(
+            facets=self.get_facets(self.object_list),
+            facet_filters=self.get_facet_filters(),
+            **kwargs
+        )
+        context["results"] = load_release_cards(context["results"], viewer_overlay(self.request))
+        return context
+    
+class UserSearchPage(AbstractCategorySearchPage):
+    template_name = "search/user_results.html"
+    paginate_by = 25
+    
+    def get_queryset(self):
+        return self.search_users()
 
 class SearchAPI(APIView, AbstractSearchPage):
     """"An API for search autocompletion"""
     
-    def get(self, request):
+    #Shown after the artists and releases
+    user_limit = 3
+    
+    def search_database(self):
+        """Matches found by the (typo tolerant) database search"""
+        
         #Used to differentiate search result kinds
         artist_category, release_category = 0, 1
         
@@ -112,23 +221,48 @@ class SearchAPI(APIView, AbstractSearchPage):
             for category in [artist_category, release_category]
         )
         
-        #Fetch the full objects and turn them into menu items
-        
+        #(Without keys, as these matches are incomplete so won't be filtered)
         artists = [
-            {"name": artist.name, "url": url_for_artist(artist)}
+            Item(artist.name, artist.slug, keys=[])
             for artist in Artist.objects.in_bulk(artist_ids).values()
         ]
         
         releases = [
-            {
-                "name": release.title + " by "
-                    + " & ".join(artist.name for artist in release.artists.all()),
-                "url": url_for_release(release)
-            }
-            for release in Release.objects.in_bulk(release_ids).values()
+            Item(
+                release.title + " by " + " & ".join(artist.name for artist in release.artists.all()),
+                release.slug, keys=[]
+            )
+            for release in Release.objects.prefetch_related("artists").in_bulk(release_ids).values()
         ]
         
-        return Response({
+        return Matches(artists, releases, complete=False)
+    
+    def get(self, request):
+        query_str = self.get_query_str() or ""
+        
+        #Prefixes are found in memory (or the cache), without querying the database.
+        #Fall back to the database for fuzzy matches, in case of a typo.
+        result = autocomplete_cache.search(
+            query_str,
+            fallback=self.search_database if len(query_str) >= self.fuzzy_min_length else None
+        )
+        
+        #Users are new and renamed too often to be cached, but a prefix match is a quick index scan
+        users = User.objects.filter(username__istartswith=query_str).order_by("username") \
+            [:self.user_limit] if query_str else []
+        
+        results = [
             #Show artists before releases (for predictability as much as code simplicity)
-            "results": artists + releases
-        })
+            {"name": artist.name, "url": url_for_artist(artist)} for artist in result.artists
+        ] + [
+            {"name": release.name, "url": url_for_release(release)} for release in result.releases
+        ] + [
+            {"name": user.username, "url": url_for_user(user)} for user in users
+        ]
+        
+        headers = {"ETag": '"%s"' % md5(repr(results).encode()).hexdigest()}
+        
+        if headers["ETag"] in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers=headers)
+        
+        return Response({"results": results}, headers=headers)
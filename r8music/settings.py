@@ -46,11 +46,13 @@ INSTALLED_APPS = [
     'r8music.music',
     'r8music.actions',
     'r8music.search',
+    'r8music.recommendations',
     'r8music.v1transfer',
     'r8music.importation',
 ]
 
 MIDDLEWARE = [
+    'r8music.db.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +63,13 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
+#Adds a Server-Timing header to every response (SQL queries, view and template
+#render time) and collects a per-route report, at /admin/profiling-report
+PROFILE_REQUESTS = False
+
+if PROFILE_REQUESTS:
+    MIDDLEWARE.insert(0, 'r8music.profiling.RequestProfilingMiddleware')
+
 ROOT_URLCONF = 'r8music.urls'
 
 TEMPLATES = [
@@ -93,17 +102,34 @@ WSGI_APPLICATION = 'r8music.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
+#The PostgreSQL backend, with health checks and pooling (see r8music/db/base.py)
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'r8music.db',
         'NAME': 'r8music',
         'USER': '',
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
+        #Keep connections open between requests, for this many seconds
+        'CONN_MAX_AGE': 60,
+        #And check that they still work before reusing them
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+#A replica of the database. Until one is set up, another connection to the
+#same database (and in tests, a separate database).
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'TEST': {'NAME': 'test_r8music_replica'},
+}
+
+#The aliases of the replicas which read-only requests are sent to (see
+#r8music/db/routers.py). None by default, so everything uses the primary.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['r8music.db.routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -0,0 +1,405 @@
+"""Generates a synthetic dataset of artists, releases, users and their actions,
+   for testing performance at a realistic scale."""
+
+from io import StringIO
+from random import Random
+from itertools import accumulate, islice
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+from django.contrib.auth.hashers import make_password
+
+from django.contrib.auth.models import User
+from r8music.profiles.models import UserSettings, UserProfile, Followership, update_all_user_stats
+from r8music.music.models import Artist, Release, ReleaseType, Track, Tag, TagRanking, generate_slug_tracked, update_search_vectors
+from r8music.actions.models import Action, SaveAction, ListenAction, RateAction, PickAction, ActiveActions
+
+#Words to build names from, so that searches match many rows
+name_words = [
+    "black", "blue", "broken", "city", "cold", "crystal", "dark", "dead", "dream",
+    "electric", "fire", "ghost", "glass", "golden", "heart", "house", "iron", "light",
+    "lost", "love", "machine", "moon", "night", "ocean", "paper", "radio", "red",
+    "river", "rose", "silver", "sky", "smoke", "snow", "star", "stone", "summer",
+    "sun", "velvet", "wave", "white", "wild", "wind", "winter", "wolf", "young"
+]
+
+tag_names = [
+    "Rock", "Indie Rock", "Post-Punk", "Shoegaze", "Dream Pop", "Electronic",
+    "Ambient", "Techno", "House", "Hip Hop", "Jazz", "Free Jazz", "Folk",
+    "Singer/Songwriter", "Blues", "Soul", "Funk", "Metal", "Black Metal",
+    "Doom Metal", "Punk", "Hardcore", "Noise", "Experimental", "Classical",
+    "Modern Classical", "Reggae", "Dub", "Country", "Psychedelic Rock"
+]
+
+#The password of every generated user
+password = "password"
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(islice(iterator, size))
+
+        if not chunk:
+            break
+
+        yield chunk
+
+# COPY, which is much faster than INSERT for large numbers of rows
+
+def copy_text(value):
+    if value is None:
+        return "\\N"
+
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+
+    else:
+        return str(value) \
+            .replace("\\", "\\\\").replace("\t", "\\t") \
+            .replace("\n", "\\n").replace("\r", "\\r")
+
+def copy_objects(model, objects):
+    """Copy objects into the table of a model, without any of its inherited
+       tables. Unlike bulk_create, this works with multi-table inheritance, but
+       IDs aren't returned. They can be assigned beforehand with reserve_ids."""
+
+    if not objects:
+        return
+
+    #Leave unassigned IDs to the database
+    fields = [
+        field for field in model._meta.local_concrete_fields
+        if not (field.primary_key and getattr(objects[0], field.attname) is None)
+    ]
+    quote = connection.ops.quote_name
+
+    rows = StringIO("".join(
+        "\t".join(
+            copy_text(field.get_db_prep_save(getattr(obj, field.attname), connection))
+            for field in fields
+        ) + "\n"
+        for obj in objects
+    ))
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            "copy %s (%s) from stdin" % (
+                quote(model._meta.db_table),
+                ", ".join(quote(field.column) for field in fields)
+            ),
+            rows
+        )
+
+def reserve_ids(model, n):
+    """Take n IDs from the sequence of a model's primary key"""
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select nextval(pg_get_serial_sequence(%s, 'id')) from generate_series(1, %s)",
+            [model._meta.db_table, n]
+        )
+        return [id for (id,) in cursor.fetchall()]
+
+def copy_actions(model, actions):
+    """Create actions of a subclass of Action, in both tables. Assigns their IDs."""
+
+    for action, id in zip(actions, reserve_ids(Action, len(actions))):
+        action.id = action.action_ptr_id = id
+
+    copy_objects(Action, actions)
+    copy_objects(model, actions)
+
+#
+
+class DatasetGenerator:
+    """Generates a dataset with the given number of artists and users. The
+       remaining quantities are averages per artist, release or user.
+
+       The number of ratings per user and the number of followers per user
+       follow power laws, as does the popularity of releases, so a few users
+       and releases account for a large part of the actions, as in reality.
+
+       Rows are created in chunks, so the memory used doesn't depend on the
+       size of the dataset (except for a few IDs per row)."""
+
+    #The exponent of the power law distributions (a Pareto distribution)
+    power_law_alpha = 1.5
+
+    def __init__(
+        self, artists=1000, releases_per_artist=3, tracks_per_release=10,
+        tags_per_release=2, users=200, follows_per_user=10,
+        ratings_per_user=25, seed=0, chunk_size=10000, log=lambda message: None
+    ):
+        self.artists, self.releases_per_artist, self.tracks_per_release = \
+            artists, releases_per_artist, tracks_per_release
+        self.tags_per_release = tags_per_release
+        self.users, self.follows_per_user, self.ratings_per_user = \
+            users, follows_per_user, ratings_per_user
+        self.chunk_size = chunk_size
+        self.log = log
+
+        self.random = Random(seed)
+        self.now = timezone.now()
+
+    def name(self, words=2):
+        return " ".join(self.random.choice(name_words) for _ in range(words)).title()
+
+    def release_date(self):
+        year = self.random.randint(1960, 2020)
+
+        #Some releases only have a year
+        if self.random.random() < 0.2:
+            return str(year)
+
+        return "%d-%02d-%02d" % (year, self.random.randint(1, 12), self.random.randint(1, 28))
+
+    def timestamp(self):
+        return self.now - timedelta(seconds=self.random.randint(0, 3*365*24*60*60))
+
+    def power_law(self, mean, maximum):
+        """An integer from a power law distribution with the given mean (before
+           being capped at the maximum)"""
+        alpha = self.power_law_alpha
+        minimum = mean * (alpha - 1) / alpha
+        return min(maximum, int(minimum * self.random.paretovariate(alpha)))
+
+    def popularity_weights(self, n):
+        """Cumulative weights for choosing from n items, by Zipf's law (the kth
+           most popular is chosen with a probability proportional to 1/k), with
+           popularity randomly assigned."""
+        weights = [1/rank for rank in range(1, n+1)]
+        self.random.shuffle(weights)
+        return list(accumulate(weights))
+
+    def choose_popular(self, items, cumulative_weights, n):
+        """Choose up to n distinct items, weighted by popularity"""
+        return set(self.random.choices(items, cum_weights=cumulative_weights, k=n))
+
+    #
+
+    def create_tags(self):
+        return [
+            tag.id for tag in
+            Tag.objects.bulk_create([Tag(name=name, title=name, description="") for name in tag_names])
+        ]
+
+    def create_artists(self):
+        used_slugs = set(Artist.objects.values_list("slug", flat=True))
+
+        def artist():
+            name = self.name(self.random.randint(1, 3))
+            return Artist(name=name, slug=generate_slug_tracked(used_slugs, name))
+
+        return [
+            artist.id
+            for chunk in chunks((artist() for _ in range(self.artists)), self.chunk_size)
+            for artist in Artist.objects.bulk_create(chunk)
+        ]
+
+    def create_releases(self, artist_ids, tag_ids):
+        used_slugs = set(Release.objects.values_list("slug", flat=True))
+        release_ids = []
+
+        def release():
+            title = self.name(self.random.randint(1, 4))
+
+            return Release(
+                title=title, slug=generate_slug_tracked(used_slugs, title),
+                type=ReleaseType.ALBUM if self.random.random() < 0.7 else ReleaseType.EP,
+                release_date=self.release_date()
+            )
+
+        n = len(artist_ids) * self.releases_per_artist
+
+        for chunk in chunks((release() for _ in range(n)), self.chunk_size):
+            releases = Release.objects.bulk_create(chunk)
+            release_ids += [release.id for release in releases]
+
+            copy_objects(Release.artists.through, [
+                Release.artists.through(release_id=release.id, artist_id=artist_id)
+                for release in releases
+                #Most releases have a single artist, some are collaborations
+                for artist_id in self.random.sample(artist_ids, 1 if self.random.random() < 0.9 else 2)
+            ])
+
+            copy_objects(Release.tags.through, [
+                Release.tags.through(release_id=release.id, tag_id=tag_id)
+                for release in releases
+                for tag_id in self.random.sample(tag_ids, self.random.randint(0, 2*self.tags_per_release))
+            ])
+
+            self.log("%d releases" % len(release_ids))
+
+        Tag.objects.filter(id__in=tag_ids).update_release_counts()
+        return release_ids
+
+    def create_tracks(self, release_ids):
+        """Returns the track IDs of each release"""
+        track_ids = {}
+
+        if not self.tracks_per_release:
+            return track_ids
+
+        for chunk in chunks(release_ids, max(1, self.chunk_size // max(1, self.tracks_per_release))):
+            tracks = [
+                Track(
+                    release_id=release_id, title=self.name(), side=1, position=position,
+                    runtime=self.random.randint(60, 600)*1000
+                )
+                for release_id in chunk
+                for position in range(1, self.random.randint(1, 2*self.tracks_per_release) + 1)
+            ]
+
+            for track, id in zip(tracks, reserve_ids(Track, len(tracks))):
+                track.id = id
+                track_ids.setdefault(track.release_id, []).append(id)
+
+            copy_objects(Track, tracks)
+
+        return track_ids
+
+    def create_users(self):
+        password_hash = make_password(password)
+
+        users = (
+            User(username="user%d" % n, email="user%d@example.com" % n,
+                 password=password_hash, date_joined=self.timestamp())
+            for n in range(self.users)
+        )
+
+        user_ids = []
+
+        for chunk in chunks(users, self.chunk_size):
+            chunk = User.objects.bulk_create(chunk)
+            user_ids += [user.id for user in chunk]
+
+            UserSettings.objects.bulk_create([UserSettings(user=user) for user in chunk])
+            UserProfile.objects.bulk_create([
+                UserProfile(user=user, avatar_url="https://i.imgur.com/avatar.png") for user in chunk
+            ])
+
+        return user_ids
+
+    def create_follows(self, user_ids):
+        #Some users are followed by many others
+        popularity = self.popularity_weights(len(user_ids))
+        creation = self.now
+
+        for chunk in chunks(user_ids, max(1, self.chunk_size // max(1, self.follows_per_user))):
+            follows = [
+                Followership(user_id=followed_id, follower_id=user_id, creation=creation)
+                for user_id in chunk
+                for followed_id in self.choose_popular(
+                    user_ids, popularity, self.power_law(self.follows_per_user, len(user_ids))
+                )
+                if followed_id != user_id
+            ]
+
+            copy_objects(Followership, follows)
+
+    def create_actions_for_users(self, user_ids, release_ids, popularity, track_ids):
+        saves, listens, ratings, picks = [], [], [], []
+        #Active actions as (user_id, release_id, save, listen, rate, [picks])
+        active = []
+
+        for user_id in user_ids:
+            n = self.power_law(self.ratings_per_user, len(release_ids))
+
+            for release_id in self.choose_popular(release_ids, popularity, n):
+                creation = self.timestamp()
+                kind = self.random.random()
+
+                save = listen = rate = None
+                release_picks = []
+
+                if kind < 0.1:
+                    save = SaveAction(user_id=user_id, release_id=release_id, creation=creation)
+                    saves.append(save)
+
+                else:
+                    listen = ListenAction(user_id=user_id, release_id=release_id, creation=creation)
+                    listens.append(listen)
+
+                    #Most listens are rated
+                    if kind < 0.8:
+                        rate = RateAction(
+                            user_id=user_id, release_id=release_id, creation=creation,
+                            rating=self.random.randint(1, 8)
+                        )
+                        ratings.append(rate)
+
+                        tracks = track_ids.get(release_id, [])
+                        release_picks = [
+                            PickAction(user_id=user_id, track_id=track_id, creation=creation)
+                            for track_id in self.random.sample(tracks, min(len(tracks), self.random.randint(0, 2)))
+                        ]
+                        picks += release_picks
+
+                active.append((user_id, release_id, save, listen, rate, release_picks))
+
+        for model, actions in [
+            (SaveAction, saves), (ListenAction, listens),
+            (RateAction, ratings), (PickAction, picks)
+        ]:
+            copy_actions(model, actions)
+
+        active_actions = [
+            ActiveActions(
+                id=id, user_id=user_id, release_id=release_id,
+                save_action_id=save and save.id,
+                listen_id=listen and listen.id,
+                rate_id=rate and rate.id,
+                rating=rate and rate.rating
+            )
+            for id, (user_id, release_id, save, listen, rate, _picks)
+            in zip(reserve_ids(ActiveActions, len(active)), active)
+        ]
+
+        copy_objects(ActiveActions, active_actions)
+
+        active_picks = [
+            ActiveActions.picks.through(activeactions_id=active_actions.id, pickaction_id=pick.id)
+            for active_actions, (*_, release_picks) in zip(active_actions, active)
+            for pick in release_picks
+        ]
+
+        copy_objects(ActiveActions.picks.through, active_picks)
+
+        return len(active)
+
+    def create_actions(self, user_ids, release_ids, track_ids):
+        popularity = self.popularity_weights(len(release_ids))
+        n = 0
+
+        for chunk in chunks(user_ids, max(1, self.chunk_size // max(1, self.ratings_per_user))):
+            n += self.create_actions_for_users(chunk, release_ids, popularity, track_ids)
+            self.log("%d active actions" % n)
+
+    def generate(self):
+        tag_ids = self.create_tags()
+        artist_ids = self.create_artists()
+        self.log("%d artists" % len(artist_ids))
+
+        release_ids = self.create_releases(artist_ids, tag_ids)
+        track_ids = self.create_tracks(release_ids)
+        self.log("Tracks created")
+
+        user_ids = self.create_users()
+        self.create_follows(user_ids)
+        self.log("%d users" % len(user_ids))
+
+        self.create_actions(user_ids, release_ids, track_ids)
+
+        update_all_user_stats()
+        TagRanking.objects.update_rankings(Tag.objects.all())
+        self.log("User stats and tag rankings computed")
+
+        update_search_vectors()
+        self.log("Search vectors stored")
+
+        #Without up to date statistics, the query planner can choose plans
+        #which are slower by orders of magnitude
+        with connection.cursor() as cursor:
+            cursor.execute("analyze")
@@ -0,0 +1,43 @@
+from time import perf_counter
+
+from django.test import TestCase
+
+from r8music.profiling import QueryLog
+from r8music.synthetic import DatasetGenerator
+
+class QueryBudgetTestCase(TestCase):
+    """Checks that requests stay within a budget of queries and time, against a
+       synthetic dataset. A page whose number of queries grows with the amount
+       of data shown (an N+1 query) will exceed its budget."""
+
+    #The default budget, in milliseconds. Generous, to be reliable on slow machines.
+    max_ms = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        DatasetGenerator().generate()
+
+    def assertWithinBudget(self, url, max_queries, max_ms=None, method="get", data=None):
+        with QueryLog() as log:
+            start = perf_counter()
+            response = getattr(self.client, method)(url, data)
+            duration = (perf_counter() - start)*1000
+
+        self.assertEqual(response.status_code, 200, url)
+
+        #Savepoints come from atomic blocks nested within the transaction of the
+        #test, so they wouldn't be made outside of tests
+        queries = [sql for sql, _duration in log.queries if "SAVEPOINT" not in sql]
+
+        duplicates = "\n".join(
+            "%d times: %s" % (n, shape) for shape, n in log.duplicates().items()
+        )
+
+        self.assertLessEqual(
+            len(queries), max_queries,
+            "%s made %d queries. Repeated queries:\n%s" % (url, len(queries), duplicates)
+        )
+
+        self.assertLess(duration, max_ms or self.max_ms, url)
+
+        return response
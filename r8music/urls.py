@@ -16,7 +16,10 @@ Including another URLconf
 from django.contrib import admin
 from django.conf.urls import url, include
 
+from r8music.profiling import profiling_report
+
 urlpatterns = [
+    url(r"^admin/profiling-report$", profiling_report, name="profiling_report"),
     url(r"^admin/", admin.site.urls),
     url(r"^", include("r8music.profiles.urls")),
     url(r"^", include("r8music.music.urls")),
@@ -5,7 +5,7 @@ from itertools import count, groupby
 from functools import lru_cache
 from collections import namedtuple
 from enum import Enum
-from werkzeug import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash, generate_password_hash
 from flask import url_for
 from unidecode import unidecode
 
@@ -0,0 +1,46 @@
+import sqlite3
+from pathlib import Path
+
+from django.test import TestCase
+from django.urls import reverse
+
+from r8music.music.models import Release
+from r8music.v1.model import Model
+from r8music.search.autocomplete import autocomplete_index
+from .transfer import Transferer
+
+v1_schema = Path(__file__).parent.parent / "v1" / "schema.sql"
+
+class TransferTest(TestCase):
+    def setUp(self):
+        model = Model(connect_db=lambda: sqlite3.connect(":memory:"))
+        model.db.executescript(v1_schema.read_text())
+        
+        for query, *args in [
+            ("insert into objects (id, type) values (?, ?), (?, ?)", 1, 1, 2, 2),
+            ("insert into artists (id, name, slug) values (?, ?, ?)", 1, "Björk", "bjork"),
+            (
+                "insert into releases (id, title, slug, date, type) values (?, ?, ?, ?, ?)",
+                2, "Homogenic", "homogenic", "1997-09-22", "Album"
+            ),
+            ("insert into authorships (release_id, artist_id) values (?, ?)", 2, 1),
+            ("insert into link_types (id, type) values (?, ?)", 1, "musicbrainz"),
+            ("insert into links (id, type_id, target) values (?, ?, ?)", 1, 1, "artist-mbid")
+        ]:
+            model.db.execute(query, args)
+            
+        self.transferer = Transferer(model)
+        #(Rather than querying MusicBrainz)
+        self.transferer.query_release_group_mbids = lambda: setattr(self.transferer, "release_mbids", {})
+        
+    def test_searchable(self):
+        self.transferer.transfer_database()
+        release = Release.objects.get(title="Homogenic")
+        
+        #By its artist's name, which only the search vector includes
+        response = self.client.get(reverse("release_search"), {"q": "bjork"})
+        self.assertEqual([result.id for result in response.context_data["results"]], [release.id])
+        
+        autocomplete_index.clear()
+        response = self.client.get(reverse("search_api"), {"q": "homog"})
+        self.assertEqual([result["name"] for result in response.json()["results"]], ["Homogenic by Björk"])
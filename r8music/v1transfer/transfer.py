@@ -5,7 +5,7 @@ from django.db import transaction
 
 from django.contrib.auth.models import User
 from r8music.profiles.models import UserSettings, UserProfile, UserRatingDescription, Followership
-from r8music.music.models import Artist, Release, ReleaseType, Track, Tag, DiscogsTag, ArtistExternalLink, ReleaseExternalLink, generate_slug_tracked
+from r8music.music.models import Artist, Release, ReleaseType, Track, Tag, TagRanking, DiscogsTag, ArtistExternalLink, ReleaseExternalLink, generate_slug_tracked, update_search_vectors
 from r8music.actions.models import SaveAction, ListenAction, RateAction, PickAction
 
 from r8music.importation.models import ArtistMBLink, ReleaseMBLink, ReleaseDuplication
@@ -355,6 +355,8 @@ class Transferer:
             )
         ])
         
+        Tag.objects.update_release_counts()
+        
     #
     
     def transfer_track(self, release_id, track_id, title, position, side, runtime):
@@ -445,3 +447,7 @@ class Transferer:
         self.transfer_all_tracks()
         if verbose: print("Transferring actions")
         self.transfer_all_actions()
+        if verbose: print("Ranking the releases of each tag")
+        TagRanking.objects.update_rankings(Tag.objects.all())
+        if verbose: print("Indexing artists and releases for search")
+        update_search_vectors()
@@ -0,0 +1,19 @@
+"""Settings for the task worker, which runs the importer and the delayed updates
+   of recommendations. Run with:
+
+   DJANGO_SETTINGS_MODULE=r8music.worker_settings python manage.py process_tasks
+
+   The worker closes its connection each time it finds no tasks (every few
+   seconds while idle), and after each task if running them in threads
+   (BACKGROUND_TASK_RUN_ASYNC), so it takes connections from a pool rather
+   than reconnecting each time."""
+
+from r8music.settings import *
+
+DATABASES["default"] = {
+    **DATABASES["default"],
+    #Returned to the pool as soon as a task is done
+    "CONN_MAX_AGE": 0,
+    #At least as many as there are threads running tasks (BACKGROUND_TASK_ASYNC_THREADS)
+    "OPTIONS": {"pool": {"min_size": 1, "max_size": 4}}
+}
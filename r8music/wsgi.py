@@ -8,9 +8,22 @@ https://docs.djangoproject.com/en/2.1/howto/deployment/wsgi/
 """
 
 import os
+import logging
 
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'r8music.settings')
 
 application = get_wsgi_application()
+
+#Build the search autocompletion index now, rather than on the first request
+from r8music.search.autocomplete import autocomplete_index
+
+try:
+    autocomplete_index.refresh()
+    
+except DatabaseError:
+    #Not to stop the server starting while the database is unavailable (it's
+    #built on first use instead)
+    logging.getLogger(__name__).exception("Failed to build the autocompletion index")